@@ -0,0 +1,49 @@
+import concurrent.futures
+import threading
+
+
+class RequestCancelled(Exception):
+    """Raised by long-running work once its request has been cancelled by
+    the client (see $/cancelRequest)."""
+    pass
+
+
+class CancellationToken:
+    """A flag shared between the thread serving a request and the thread
+    that reads its $/cancelRequest notification.
+
+    Work that may take a while should call check() every so often, so
+    that cancelled requests stop promptly instead of running to
+    completion.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise RequestCancelled()
+
+
+def wait(future: concurrent.futures.Future, token: CancellationToken=None,
+         interval: float=0.1):
+    """Returns the result of future, which is shared with other requests,
+    raising RequestCancelled if token is cancelled first.
+
+    The work behind future carries on either way, so that a cancelled
+    request doesn't abandon it for everyone else.
+    """
+    if token is None:
+        return future.result()
+    while True:
+        token.check()
+        try:
+            return future.result(timeout=interval)
+        except concurrent.futures.TimeoutError:
+            pass
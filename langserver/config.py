@@ -1,4 +1,5 @@
-import distutils
+import distutils.sysconfig
+import os.path
 
 
 class GlobalConfig:
@@ -9,3 +10,44 @@ class GlobalConfig:
     PACKAGES_PARENT = "python-langserver-cache"
     STDLIB_REPO_URL = "git://github.com/python/cpython"
     STDLIB_SRC_PATH = "Lib"
+    # where the standard library module index is cached between sessions
+    STDLIB_INDEX_PATH = os.path.join(PACKAGES_PARENT, ".stdlib-index")
+
+    # maximum number of requests handled concurrently on one connection
+    REQUEST_WORKERS = 8
+    # number of processes parsing source files; None means one per CPU
+    PARSE_WORKERS = None
+
+    # where per-file analysis results (e.g. workspace symbols) are cached
+    # between sessions, and how many commits of each repository to keep
+    INDEX_CACHE_PATH = os.path.join(PACKAGES_PARENT, ".index")
+    INDEX_CACHE_COMMITS = 5
+
+    # maximum memory (in bytes) used to cache the contents of remote files
+    # in each session
+    CONTENT_CACHE_SIZE = 64 * 1024 * 1024
+
+    # maximum number of file content requests that batch reads (e.g. while
+    # scanning for x-references) keep in flight at once
+    BATCH_OPEN_WINDOW = 100
+
+    # where downloaded packages are kept for every session, and the size
+    # (in bytes) beyond which the least recently used unused ones are evicted
+    PACKAGE_STORE_PATH = os.path.join(PACKAGES_PARENT, ".packages")
+    PACKAGE_STORE_SIZE = 4 * 1024 * 1024 * 1024
+    # how long (in seconds) the version that a requirement resolved to is
+    # reused before pip is asked again
+    PACKAGE_RESOLUTION_TTL = 24 * 60 * 60
+
+    # number of dependencies downloaded at once in the background after
+    # initialize; 0 means they're only fetched when they're first needed
+    PREFETCH_WORKERS = 0
+
+    # number of files per session whose Jedi Scripts (and with them, the
+    # parse tree and resolved imports) are kept for later requests
+    SCRIPT_CACHE_SIZE = 16
+
+    # standard library modules parsed up front by --prewarm
+    PREWARM_MODULES = ["abc", "collections", "datetime", "functools", "io",
+                       "itertools", "json", "logging", "os", "re",
+                       "subprocess", "sys", "threading", "typing", "unittest"]
@@ -1,10 +1,16 @@
+import bisect
+import contextlib
 import os
 import os.path
+import sys
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 
 import opentracing
 from typing import List
 
+from .config import GlobalConfig
 from .jsonrpc import JSONRPC2Connection
 
 
@@ -32,7 +38,7 @@ class FileSystem(ABC):
 
     def batch_open(self, paths, parent_span):
         for path in paths:
-            yield (path, self.open(path))
+            yield (path, self.open(path, parent_span))
 
     def walk(self, top: str):
         dir = self.listdir(top)
@@ -62,32 +68,113 @@ class LocalFileSystem(FileSystem):
         # return entries
 
 
+class ContentCache:
+    """A least-recently-used cache of file contents, bounded by the memory
+    the cached contents take up.
+
+    It's safe to use from several threads at once. The hits and misses
+    counters can be used to judge how well the cache is sized.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str):
+        with self._lock:
+            contents = self._entries.get(path)
+            if contents is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(path)
+            return contents
+
+    def put(self, path: str, contents: str):
+        size = sys.getsizeof(contents)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size -= sys.getsizeof(old)
+            self._entries[path] = contents
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+
+
+class FileList:
+    """An immutable, sorted snapshot of the paths of the files under some
+    directory.
+
+    Keeping the paths sorted lets us answer subtree queries with two
+    binary searches instead of a scan.
+    """
+
+    def __init__(self, top: str, paths):
+        self.top = top
+        self.paths = tuple(sorted(paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def covers(self, top: str) -> bool:
+        return top == self.top or top.startswith(self.top.rstrip("/") + "/")
+
+    def under(self, top: str):
+        """Returns the paths of the files under the directory top."""
+        prefix = top.rstrip("/") + "/"
+        lo = bisect.bisect_left(self.paths, prefix)
+        # "0" is the character right after "/", so this is the first path
+        # that sorts after everything starting with prefix
+        hi = bisect.bisect_left(self.paths, prefix[:-1] + "0", lo)
+        return self.paths[lo:hi]
+
+
 class RemoteFileSystem(FileSystem):
-    def __init__(self, conn: JSONRPC2Connection):
+    def __init__(self, conn: JSONRPC2Connection,
+                 cache_size: int=GlobalConfig.CONTENT_CACHE_SIZE):
         self.conn = conn
+        # the workspace doesn't change during a session, so contents can be
+        # cached for as long as they fit
+        self.cache = ContentCache(cache_size)
+        # workspace/xfiles snapshots, fetched at most once per directory
+        self._file_lists = []
+        self._file_lists_lock = threading.Lock()
 
     def open(self, path, parent_span=None):
-        if parent_span is None:
-            resp = self.conn.send_request("textDocument/xcontent", {
-                "textDocument": {
-                    "uri": "file://" + path
-                }
-            })
-            if "error" in resp:
-                raise FileException(resp["error"])
-            return resp["result"]["text"]
+        contents = self.cache.get(path)
+        if contents is not None:
+            return contents
 
-        with opentracing.start_child_span(
-                parent_span, "RemoteFileSystem.open") as open_span:
-            open_span.set_tag("path", path)
-            resp = self.conn.send_request("textDocument/xcontent", {
-                "textDocument": {
-                    "uri": "file://" + path
-                }
-            })
-            if "error" in resp:
-                raise FileException(resp["error"])
-            return resp["result"]["text"]
+        if parent_span is None:
+            contents = self._open(path)
+        else:
+            with opentracing.start_child_span(
+                    parent_span, "RemoteFileSystem.open") as open_span:
+                open_span.set_tag("path", path)
+                contents = self._open(path)
+        self.cache.put(path, contents)
+        return contents
+
+    def _open(self, path):
+        resp = self.conn.send_request("textDocument/xcontent", {
+            "textDocument": {
+                "uri": "file://" + path
+            }
+        })
+        if "error" in resp:
+            raise FileException(resp["error"])
+        return resp["result"]["text"]
 
     def listdir(self, path, parent_span=None):
         if parent_span is None:
@@ -109,44 +196,70 @@ class RemoteFileSystem(FileSystem):
         return entries
 
     def walk(self, path):
-        resp = self.conn.send_request("workspace/xfiles",
-                                      {"base": "file://" + path})
-        if "error" in resp:
-            raise FileException(resp["error"])
-        for doc in resp["result"]:
-            uri = doc["uri"]
-            if uri.startswith("file://"):
-                yield uri[7:]
-            else:
-                yield uri
+        file_list = self.file_list(path)
+        if path == file_list.top:
+            return iter(file_list)
+        return iter(file_list.under(path))
+
+    def file_list(self, path) -> FileList:
+        """Returns a snapshot of the files under path, fetching it with
+        workspace/xfiles unless a snapshot of path or one of its parents
+        was fetched before."""
+        with self._file_lists_lock:
+            for file_list in self._file_lists:
+                if file_list.covers(path):
+                    return file_list
+
+            resp = self.conn.send_request("workspace/xfiles",
+                                          {"base": "file://" + path})
+            if "error" in resp:
+                raise FileException(resp["error"])
+            paths = []
+            for doc in resp["result"]:
+                uri = doc["uri"]
+                if uri.startswith("file://"):
+                    paths.append(uri[7:])
+                else:
+                    paths.append(uri)
+            file_list = FileList(path, paths)
+            self._file_lists.append(file_list)
+            return file_list
 
     def batch_open(self, paths, parent_span):
         with opentracing.start_child_span(
                 parent_span, "RemoteFileSystem.batch_open"):
-            # We need to read the iterator paths twice, so convert to list
-            paths = list(paths)
-            responses = self.conn.send_request_batch(("textDocument/xcontent",
-                                                      {
-                                                          "textDocument": {
-                                                              "uri":
-                                                              "file://" + path
-                                                          }
-                                                      }) for path in paths)
-            for path, resp in zip(paths, responses):
-                if "error" in resp:
-                    # Consume rest of generator to ensure resources are
-                    # shutdown
-                    for _ in responses:
-                        pass
-                    raise FileException(resp["error"])
-                yield (path, resp["result"]["text"])
+            # Serve what we can from the cache, and only fetch the rest. We
+            # need to read the missing paths twice, so collect them in a list
+            missing = []
+            for path in paths:
+                contents = self.cache.get(path)
+                if contents is None:
+                    missing.append(path)
+                else:
+                    yield (path, contents)
+            paths = missing
+            responses = self.conn.send_request_batch(
+                (("textDocument/xcontent", {
+                    "textDocument": {
+                        "uri": "file://" + path
+                    }
+                }) for path in paths),
+                window=GlobalConfig.BATCH_OPEN_WINDOW)
+            # closing responses stops any requests that haven't been sent
+            with contextlib.closing(responses):
+                for path, resp in zip(paths, responses):
+                    if "error" in resp:
+                        raise FileException(resp["error"])
+                    contents = resp["result"]["text"]
+                    self.cache.put(path, contents)
+                    yield (path, contents)
 
 
 class InMemoryFileSystem(FileSystem):
     def __init__(self, contents):
         self.contents = contents
 
-    def open(self, path: str, parent_span) -> str:
+    def open(self, path: str, parent_span=None) -> str:
         if path in self.contents:
             return self.contents[path]
         raise FileException('File not found ' + path)
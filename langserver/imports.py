@@ -1,69 +1,119 @@
 import ast
-import itertools
-import multiprocessing
 
+from .index_cache import content_hash
+from .parse_pool import map_unordered
+
+
+class ImportGraph:
+    """The top-level imports of each file in a workspace, and the reverse
+    mapping from each top-level package to the files that import it."""
+
+    def __init__(self):
+        # path -> tuple of (module, level) for each import in the file
+        self.imports = {}
+        # top-level package name -> set of paths
+        self.importers = {}
+
+    def add(self, path, rows):
+        self.imports[path] = rows
+        for module, _ in rows:
+            self.importers.setdefault(module.split(".")[0], set()).add(path)
+
+    def files_importing(self, package):
+        """Returns the paths of the files that import package (or one of
+        its submodules), in sorted order.
+
+        Like ReferenceFilteringVisitor, this counts relative imports of a
+        module with the same name.
+        """
+        return sorted(self.importers.get(package, ()))
+
+    def packages(self):
+        """Returns the set of top-level packages imported by absolute
+        imports anywhere in the workspace."""
+        return {module.split(".")[0]
+                for rows in self.imports.values()
+                for module, level in rows if not level}
+
+
+def build_import_graph(fs, root_path, parent_span, token=None, cache=None):
+    """Returns the ImportGraph of the Python files under root_path in fs.
+
+    If cache (a FileIndexCache) is given, only the files whose contents
+    aren't in it are parsed, and none are read if it has a manifest for
+    this commit.
+    """
+    if cache is not None:
+        graph = _cached_import_graph(cache)
+        if graph is not None:
+            return graph
 
-def get_imports(fs, root_path, parent_span):
     # TODO: consider crawling over the main project files only; ignore
     # examples, tests, etc
     py_paths = (path for path in fs.walk(root_path) if path.endswith(".py"))
     py_srces = fs.batch_open(py_paths, parent_span)
-    with multiprocessing.Pool() as p:
-        import_chunks = p.imap_unordered(
-            _imap_extract_imports, py_srces, chunksize=10)
-        imports = {i.split(".")[0]
-                   for i in itertools.chain.from_iterable(import_chunks)}
-    return imports
+    manifest = {}
+    graph = ImportGraph()
+
+    def uncached_srces():
+        for path, src in py_srces:
+            digest = content_hash(src)
+            manifest[path] = digest
+            rows = cache.get(digest) if cache is not None else None
+            if rows is None:
+                yield path, src, digest
+            else:
+                graph.add(path, rows)
+
+    rows_chunks = map_unordered(_imap_extract_import_rows, uncached_srces(),
+                                token)
+    for path, digest, rows in rows_chunks:
+        if token:
+            token.check()
+        if cache is not None:
+            cache.put(digest, rows)
+        graph.add(path, rows)
+    if token:
+        # a cancelled request may have stopped feeding the pool early
+        token.check()
 
+    if cache is not None:
+        cache.save(manifest)
+    return graph
 
-def _imap_extract_imports(args):
-    path, src = args
-    return set(extract_imports(src, path))
 
+def _cached_import_graph(cache):
+    manifest = cache.manifest()
+    if manifest is None:
+        return None
+    graph = ImportGraph()
+    for path, digest in manifest.items():
+        rows = cache.get(digest)
+        if rows is None:
+            return None
+        graph.add(path, rows)
+    return graph
 
-def extract_imports(source, path):
+
+# This exists purely for passing into imap
+def _imap_extract_import_rows(args):
+    path, src, digest = args
+    return path, digest, extract_import_rows(src)
+
+
+def extract_import_rows(source):
+    """Returns a (module, level) tuple for each of the top-level imports in
+    source."""
     try:
         tree = ast.parse(source)
     except SyntaxError:
-        return
-
-    v = ImportVisitor()
-    for i in v.visit(tree):
-        yield i
-
-
-class ImportVisitor:
-
-    def visit_Module(self, node, container):
-        # Modules is our global scope. Just visit all the children
-        yield from self.generic_visit(node)
-
-    def visit_Import(self, node, container):
-        for n in node.names:
-            yield n.name
-
-    def visit_ImportFrom(self, node, container):
-        # we only care about top-level imports, and definitely want to
-        # ignore internal imports
-        if not node.level:
-            yield node.module
-
-    # Based on ast.NodeVisitor.visit
-    def visit(self, node, container=None):
-        # Two changes from ast.NodeVisitor.visit:
-        # * Do not fallback to generic_visit (we only care about top-level)
-        # * container optional argument
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, None)
-        if visitor is not None:
-            yield from visitor(node, container)
-
-    # Based on ast.NodeVisitor.generic_visit
-    def generic_visit(self, node, container=None):
-        for field, value in ast.iter_fields(node):
-            if isinstance(value, list):
-                for item in value:
-                    if isinstance(item, ast.AST):
-                        yield from self.visit(item, container)
-            elif isinstance(value, ast.AST):
-                yield from self.visit(value, container)
+        return ()
+
+    rows = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            rows.extend((n.name, 0) for n in node.names if n.name)
+        elif isinstance(node, ast.ImportFrom):
+            if node.module:
+                rows.append((node.module, node.level or 0))
+    return tuple(rows)
@@ -0,0 +1,139 @@
+"""This module persists per-file analysis results (e.g. the symbols defined
+in each file) between sessions."""
+
+import fcntl
+import hashlib
+import logging
+import os
+import os.path
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .config import GlobalConfig
+
+log = logging.getLogger(__name__)
+
+# bump this whenever the layout of the cache files changes
+FORMAT_VERSION = 1
+
+
+def content_hash(source: str) -> bytes:
+    return hashlib.sha1(source.encode("utf-8", "surrogatepass")).digest()
+
+
+class FileIndexCache:
+    """Results of analyzing the files of a repository, keyed by the hash of
+    each file's contents.
+
+    Results are shared by all the commits of a repository, so a new
+    commit only has to re-analyze the files that changed. For each of
+    the last few commits we also keep a manifest mapping every file to
+    its content hash, so a session for a commit we've already seen
+    doesn't have to read the files at all.
+    """
+
+    def __init__(self, kind: str, repo_key: str, commit: str=None):
+        """
+        :param kind: the kind of result being cached (e.g. "symbols")
+        :param repo_key: identifies the repository (see Workspace.repo_key)
+        :param commit: the commit being served, if known
+        """
+        self.path = os.path.join(GlobalConfig.INDEX_CACHE_PATH, kind,
+                                 repo_key + ".pickle")
+        self.commit = commit
+        self._lock = threading.Lock()
+        self._manifests = OrderedDict()
+        self._results = {}
+        self._load()
+
+    def _load(self):
+        self._manifests, self._results = self._read()
+
+    def _read(self):
+        """Returns the manifests and results saved in the cache file."""
+        try:
+            with open(self.path, "rb") as f:
+                version, manifests, results = pickle.load(f)
+        except FileNotFoundError:
+            return OrderedDict(), {}
+        except Exception as e:
+            log.warning("Ignoring unreadable index cache %s: %s", self.path, e)
+            return OrderedDict(), {}
+        if version != FORMAT_VERSION:
+            return OrderedDict(), {}
+        return manifests, results
+
+    def manifest(self):
+        """Returns the {path: content hash} mapping saved for this commit,
+        or None if we haven't seen it before."""
+        if self.commit is None:
+            return None
+        with self._lock:
+            return self._manifests.get(self.commit)
+
+    def get(self, digest: bytes):
+        with self._lock:
+            return self._results.get(digest)
+
+    def put(self, digest: bytes, result):
+        with self._lock:
+            self._results[digest] = result
+
+    def save(self, manifest):
+        """Records manifest as the contents of this commit and writes the
+        cache to disk, dropping the results no longer used by any of the
+        commits we keep.
+
+        Sessions for other commits of the repository may have saved the
+        cache since we loaded it, so their manifests and results are
+        merged with ours rather than overwritten.
+        """
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                lock_file = open(self.path + ".lock", "a")
+            except OSError as e:
+                log.warning("Unable to write index cache %s: %s", self.path, e)
+                return
+            with lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._merge(manifest)
+                    self._write()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _merge(self, manifest):
+        manifests, results = self._read()
+        if self.commit is not None:
+            manifests.pop(self.commit, None)
+            manifests[self.commit] = manifest
+            while len(manifests) > GlobalConfig.INDEX_CACHE_COMMITS:
+                manifests.popitem(last=False)
+        results.update(self._results)
+        used = set(manifest.values())
+        for m in manifests.values():
+            used.update(m.values())
+        self._manifests = manifests
+        self._results = {digest: result
+                         for digest, result in results.items()
+                         if digest in used}
+
+    def _write(self):
+        data = (FORMAT_VERSION, self._manifests, self._results)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        except OSError as e:
+            log.warning("Unable to write index cache %s: %s", self.path, e)
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            # rename into place, so concurrent sessions never read a
+            # partial file
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Unable to write index cache %s: %s", self.path, e)
+            os.unlink(tmp_path)
@@ -1,5 +1,10 @@
+from collections import OrderedDict
 from os import path as filepath
+import contextlib
+import copy
+import functools
 import os
+import threading
 
 import jedi
 import jedi._compatibility
@@ -7,7 +12,9 @@ import jedi._compatibility
 import opentracing
 from typing import List
 
+from .config import GlobalConfig
 from .fs import RemoteFileSystem, TestFileSystem
+from .index_cache import content_hash
 
 
 class Module:
@@ -31,11 +38,31 @@ class DummyFile:
         pass
 
 
+class ScriptContext:
+    """The span and cancellation token of the request that a Script's
+    callbacks are currently working on behalf of."""
+
+    def __init__(self, span, token=None):
+        self.span = span
+        self.token = token
+
+
 class RemoteJedi:
+    """Creates Jedi Scripts that resolve imports and read files through the
+    workspace, and provides the callbacks they use to do so.
+
+    One RemoteJedi serves a whole session. It remembers how each import
+    was resolved, so later Scripts don't repeat the same lookups.
+    """
+
     def __init__(self, fs, workspace, root_path):
         self.fs = fs
         self.workspace = workspace
         self.root_path = root_path
+        # (name, search dirs, qualified name) -> the result of
+        # find_module_remote, or None if the module wasn't found
+        self._resolved = {}
+        self._resolved_lock = threading.Lock()
 
     def new_script(self, *args, **kwargs):
         """Return an initialized Jedi API Script object."""
@@ -44,14 +71,18 @@ class RemoteJedi:
             del kwargs["parent_span"]
         else:
             parent_span = opentracing.tracer.start_span("new_script_parent")
+        token = kwargs.pop("token", None)
+        context = kwargs.pop("context", None)
 
         with opentracing.start_child_span(parent_span,
                                           "new_script") as new_script_span:
             path = kwargs.get("path")
             new_script_span.set_tag("path", path)
-            return self._new_script_impl(new_script_span, *args, **kwargs)
+            if context is None:
+                context = ScriptContext(new_script_span, token)
+            return self._new_script_impl(context, *args, **kwargs)
 
-    def _new_script_impl(self, parent_span, *args, **kwargs):
+    def _new_script_impl(self, context, *args, **kwargs):
         path = kwargs.get("path")
 
         trace = False
@@ -59,79 +90,6 @@ class RemoteJedi:
             trace = True
             del kwargs['trace']
 
-        def find_module_remote(string, dir=None, fullname=None):
-            """A swap-in replacement for Jedi's find module function that uses
-            the remote fs to resolve module imports."""
-            if dir is None:
-                dir = get_module_search_paths(string, path)
-            with opentracing.start_child_span(
-                    parent_span,
-                    "find_module_remote_callback") as find_module_span:
-                if trace:
-                    print("find_module_remote", string, dir, fullname)
-
-                the_module = None
-
-                # TODO: move this bit of logic into the Workspace?
-                # default behavior is to search for built-ins first, but skip
-                # this if we're actually in the stdlib repo
-                if fullname and not self.workspace.is_stdlib:
-                    the_module = self.workspace.find_stdlib_module(fullname)
-
-                if the_module == "native":  # break if we get a native module
-                    raise ImportError(
-                        'Module "{}" not found in {}', string, dir)
-
-                # TODO: use this clause's logic for the other clauses too
-                # (stdlib and external modules) after searching for built-ins,
-                # search the current project
-                if not the_module:
-                    module_file, module_path, is_package = self.workspace.find_internal_module(
-                        string, fullname, dir)
-                    if module_file or module_path:
-                        if is_package and module_path.endswith(".py"):
-                            module_path = os.path.dirname(module_path)
-                        return module_file, module_path, is_package
-
-                # finally, search 3rd party dependencies
-                if not the_module:
-                    the_module = self.workspace.find_external_module(fullname)
-
-                if not the_module:
-                    raise ImportError(
-                        'Module "{}" not found in {}', string, dir)
-
-                is_package = the_module.is_package
-                module_file = self.workspace.open_module_file(
-                    the_module, find_module_span)
-                module_path = the_module.path
-                if is_package and the_module.is_namespace_package:
-                    module_path = jedi._compatibility.ImplicitNSInfo(
-                        fullname, [module_path])
-                    is_package = False
-                elif is_package and module_path.endswith(".py"):
-                    module_path = filepath.dirname(module_path)
-                return module_file, module_path, is_package
-
-        # TODO: update this to use the workspace's module indices
-        def list_modules() -> List[str]:
-            if trace:
-                print("list_modules")
-            modules = [
-                f for f in self.fs.walk(self.root_path)
-                if f.lower().endswith(".py")
-            ]
-            return modules
-
-        def load_source(path) -> str:
-            with opentracing.start_child_span(
-                    parent_span, "load_source_callback") as load_source_span:
-                load_source_span.set_tag("path", path)
-                if trace:
-                    print("load_source", path)
-                result = self.fs.open(path, load_source_span)
-                return result
-
         # TODO(keegan) It shouldn't matter if we are using a remote fs or not.
         # Consider other ways to hook into the import system.
         # TODO(aaron) Also, it shouldn't matter whether we're using a "real"
@@ -139,14 +97,191 @@ class RemoteJedi:
         if isinstance(self.fs, RemoteFileSystem) or isinstance(
                 self.fs, TestFileSystem):
             kwargs.update(
-                find_module=find_module_remote,
-                list_modules=list_modules,
-                load_source=load_source,
+                find_module=functools.partial(
+                    self.find_module_remote, context, path, trace),
+                list_modules=functools.partial(
+                    self.list_modules, context, trace),
+                load_source=functools.partial(
+                    self.load_source, context, trace),
                 fs=self.fs
             )
 
         return jedi.api.Script(*args, **kwargs)
 
+    def find_module_remote(self, context, script_path, trace, string,
+                           dir=None, fullname=None):
+        """A swap-in replacement for Jedi's find module function that uses
+        the remote fs to resolve module imports."""
+        if context.token:
+            context.token.check()
+        if dir is None:
+            dir = get_module_search_paths(string, script_path)
+        dir = tuple(dir)
+        if trace:
+            print("find_module_remote", string, dir, fullname)
+
+        key = (string, dir, fullname)
+        with self._resolved_lock:
+            resolved = self._resolved.get(key, False)
+        if resolved is False:
+            with opentracing.start_child_span(
+                    context.span,
+                    "find_module_remote_callback") as find_module_span:
+                resolved = self._find_module(string, dir, fullname,
+                                             find_module_span)
+            with self._resolved_lock:
+                self._resolved[key] = resolved
+
+        if resolved is None:
+            raise ImportError(
+                'Module "{}" not found in {}', string, dir)
+        return resolved
+
+    def _find_module(self, string, dir, fullname, parent_span):
+        the_module = None
+
+        # TODO: move this bit of logic into the Workspace?
+        # default behavior is to search for built-ins first, but skip
+        # this if we're actually in the stdlib repo
+        if fullname and not self.workspace.is_stdlib:
+            the_module = self.workspace.find_stdlib_module(fullname)
+
+        if the_module == "native":  # break if we get a native module
+            return None
+
+        # TODO: use this clause's logic for the other clauses too
+        # (stdlib and external modules) after searching for built-ins,
+        # search the current project
+        if not the_module:
+            module_file, module_path, is_package = self.workspace.find_internal_module(
+                string, fullname, dir)
+            if module_file or module_path:
+                if is_package and module_path.endswith(".py"):
+                    module_path = os.path.dirname(module_path)
+                return module_file, module_path, is_package
+
+        # finally, search 3rd party dependencies
+        if not the_module:
+            the_module = self.workspace.find_external_module(fullname)
+
+        if not the_module:
+            return None
+
+        is_package = the_module.is_package
+        module_file = self.workspace.open_module_file(
+            the_module, parent_span)
+        module_path = the_module.path
+        if is_package and the_module.is_namespace_package:
+            module_path = jedi._compatibility.ImplicitNSInfo(
+                fullname, [module_path])
+            is_package = False
+        elif is_package and module_path.endswith(".py"):
+            module_path = filepath.dirname(module_path)
+        return module_file, module_path, is_package
+
+    # TODO: update this to use the workspace's module indices
+    def list_modules(self, context, trace) -> List[str]:
+        if context.token:
+            context.token.check()
+        if trace:
+            print("list_modules")
+        modules = [
+            f for f in self.fs.walk(self.root_path)
+            if f.lower().endswith(".py")
+        ]
+        return modules
+
+    def load_source(self, context, trace, path) -> str:
+        if context.token:
+            context.token.check()
+        with opentracing.start_child_span(
+                context.span, "load_source_callback") as load_source_span:
+            load_source_span.set_tag("path", path)
+            if trace:
+                print("load_source", path)
+            result = self.fs.open(path, load_source_span)
+            return result
+
+
+class ScriptCache:
+    """Keeps the Jedi Scripts of the most recently used files, keyed by path
+    and content hash.
+
+    Consecutive requests on the same file (e.g. hover, then definition,
+    then references) reuse the Script's parse tree and its evaluator,
+    which remembers every import it has already resolved. A Script is
+    taken out of the cache while a request is using it, since Jedi's
+    evaluator can't be shared by concurrent requests.
+    """
+
+    def __init__(self, remote_jedi: RemoteJedi,
+                 size: int=GlobalConfig.SCRIPT_CACHE_SIZE):
+        self.remote_jedi = remote_jedi
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._scripts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def checkout(self, path, source, line, column, parent_span, token=None,
+                 failed=None):
+        """Provides a Script for the given position in source, returning it
+        to the cache if the block exits normally and failed (if given)
+        returns False by then."""
+        _check_position(source, line, column)
+        key = (path, content_hash(source))
+        with self._lock:
+            entry = self._scripts.pop(key, None)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            context = ScriptContext(parent_span, token)
+            script = self.remote_jedi.new_script(
+                path=path, source=source, line=line, column=column,
+                parent_span=parent_span, context=context)
+        else:
+            script, context = entry
+            context.span, context.token = parent_span, token
+
+        yield _at_position(script, line, column)
+
+        # Only reached if the block didn't raise. An exception (e.g.
+        # RequestCancelled from one of the callbacks) that interrupts Jedi's
+        # inference leaves the evaluator's memoized results half-computed,
+        # so that Script is dropped rather than reused, including when the
+        # request caught the exception itself.
+        if failed is not None and failed():
+            return
+        with self._lock:
+            self._scripts.pop(key, None)
+            self._scripts[key] = (script, context)
+            while len(self._scripts) > self.size:
+                self._scripts.popitem(last=False)
+
+
+def _check_position(source, line, column):
+    """Raises ValueError if (line, column) isn't a position in source, like
+    Jedi's Script constructor does."""
+    lines = source.split("\n")
+    if not 0 < line <= len(lines):
+        raise ValueError('`line` parameter is not in a valid range.')
+    if not 0 <= column <= len(lines[line - 1].rstrip("\r")):
+        raise ValueError('`column` parameter is not in a valid range.')
+
+
+def _at_position(script, line, column):
+    """Returns a Script for another position in the same file as script,
+    sharing its parse tree and evaluator. The position must already have
+    been checked with _check_position."""
+    if script._pos == (line, column):
+        return script
+    moved = copy.copy(script)
+    moved._pos = (line, column)
+    return moved
+
 
 def get_module_search_paths(module_name, script_file_path):
     """Provides an ordered list of directories in the workspace to search for
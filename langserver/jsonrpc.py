@@ -3,15 +3,43 @@ import logging
 import queue
 import threading
 from collections import deque
+from concurrent.futures import Future
+
+try:
+    # orjson is considerably faster than the standard library for the large
+    # messages we exchange (e.g. workspace/xfiles responses), so use it when
+    # it's installed.
+    import orjson
+except ImportError:
+    orjson = None
 
 log = logging.getLogger(__name__)
 
 
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers wider than 64 bits, which json handles
+            pass
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
 class JSONRPC2ProtocolError(Exception):
     pass
 
 
 class ReadWriter:
+    """Reads and writes bytes on a pair of binary streams (e.g.
+    sys.stdin.buffer and sys.stdout.buffer)."""
+
     def __init__(self, reader, writer):
         self.reader = reader
         self.writer = writer
@@ -22,35 +50,57 @@ class ReadWriter:
     def read(self, *args):
         return self.reader.read(*args)
 
-    def write(self, out):
-        self.writer.write(out)
+    def read_exactly(self, size: int):
+        """Reads exactly size bytes into a buffer allocated up front."""
+        buf = bytearray(size)
+        if not hasattr(self.reader, "readinto"):
+            data = self.reader.read(size)
+            if len(data) < size:
+                raise EOFError()
+            buf[:] = data
+            return buf
+        view = memoryview(buf)
+        pos = 0
+        while pos < size:
+            n = self.reader.readinto(view[pos:])
+            if not n:
+                raise EOFError()
+            pos += n
+        return buf
+
+    def write(self, *chunks):
+        for chunk in chunks:
+            self.writer.write(chunk)
         self.writer.flush()
 
 
 class TCPReadWriter(ReadWriter):
-    def readline(self, *args):
-        data = self.reader.readline(*args)
-        return data.decode("utf-8")
-
-    def read(self, *args):
-        return self.reader.read(*args).decode("utf-8")
-
-    def write(self, out):
-        self.writer.write(out.encode())
-        self.writer.flush()
+    """Reads and writes bytes on the files of a socket."""
+    pass
 
 
 class JSONRPC2Connection:
     def __init__(self, conn=None):
         self.conn = conn
-        self._msg_buffer = deque()
+        # Requests and notifications from the other side, in the order they
+        # were received. None marks the end of the connection.
+        self._incoming = queue.Queue()
         self._next_id = 1
+        self._id_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Responses to the requests we've sent, keyed by request id. The
+        # reader thread completes them as the responses arrive.
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._reader = None
+        self._reader_lock = threading.Lock()
+        self._closed = False
 
     def _read_header_content_length(self, line):
-        if len(line) < 2 or line[-2:] != "\r\n":
+        if len(line) < 2 or line[-2:] != b"\r\n":
             raise JSONRPC2ProtocolError("Line endings must be \\r\\n")
-        if line.startswith("Content-Length: "):
-            _, value = line.split("Content-Length: ")
+        if line.startswith(b"Content-Length: "):
+            _, value = line.split(b"Content-Length: ")
             value = value.strip()
             try:
                 return int(value)
@@ -60,48 +110,85 @@ class JSONRPC2Connection:
 
     def _receive(self):
         line = self.conn.readline()
-        if line == "":
+        if not line:
             raise EOFError()
         length = self._read_header_content_length(line)
         # Keep reading headers until we find the sentinel line for the JSON
         # request.
-        while line != "\r\n":
+        while line != b"\r\n":
             line = self.conn.readline()
-        body = self.conn.read(length)
+            if not line:
+                raise EOFError()
+        body = self.conn.read_exactly(length)
         log.debug("RECV %s", body)
-        return json.loads(body)
-
-    def read_message(self, want=None):
-        """Read a JSON RPC message sent over the current connection.
-
-        If id is None, the next available message is returned.
-        """
-        if want is None:
-            if self._msg_buffer:
-                return self._msg_buffer.popleft()
-            return self._receive()
-
-        # First check if our buffer contains something we want.
-        msg = deque_find_and_pop(self._msg_buffer, want)
-        if msg:
-            return msg
-
-        # We need to keep receiving until we find something we want.
-        # Things we don't want are put into the buffer for future callers.
+        return json_loads(body)
+
+    def _start_reader(self):
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = threading.Thread(
+                    target=self._read_loop, daemon=True)
+                self._reader.start()
+
+    def _read_loop(self):
+        """Receives every message sent over the connection, routing
+        responses to the requests waiting for them and queueing the rest
+        for read_message."""
         while True:
-            msg = self._receive()
-            if want(msg):
-                return msg
-            self._msg_buffer.append(msg)
+            try:
+                msg = self._receive()
+            except (EOFError, OSError) as e:
+                if not isinstance(e, EOFError):
+                    log.error("Error reading from connection: %s", e)
+                self._close()
+                return
+            except Exception as e:
+                log.error("Unexpected error: %s", e, exc_info=True)
+                continue
+
+            if "method" not in msg:
+                with self._pending_lock:
+                    future = self._pending.pop(msg.get("id"), None)
+                if future:
+                    future.set_result(msg)
+                else:
+                    log.warning("Dropping response to unknown request %s",
+                                msg.get("id"))
+                continue
+
+            self._incoming.put(msg)
+
+    def _close(self):
+        with self._pending_lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(EOFError())
+        self._incoming.put(None)
+
+    def read_message(self):
+        """Read the next JSON RPC request or notification sent over the
+        current connection. Responses to our own requests are returned by
+        send_request and send_request_batch instead.
+
+        This is safe to call from several threads at once.
+        """
+        self._start_reader()
+        msg = self._incoming.get()
+        if msg is None:
+            # leave the marker for any other callers
+            self._incoming.put(None)
+            raise EOFError()
+        return msg
 
     def _send(self, body):
-        body = json.dumps(body, separators=(",", ":"))
-        content_length = len(body)
-        response = (
-            "Content-Length: {}\r\n"
-            "Content-Type: application/vscode-jsonrpc; charset=utf8\r\n\r\n"
-            "{}".format(content_length, body))
-        self.conn.write(response)
+        body = json_dumps(body)
+        header = (
+            b"Content-Length: %d\r\n"
+            b"Content-Type: application/vscode-jsonrpc; charset=utf8\r\n\r\n"
+            % len(body))
+        with self._write_lock:
+            self.conn.write(header, body)
         log.debug("SEND %s", body)
 
     def write_response(self, rid, result):
@@ -126,9 +213,23 @@ class JSONRPC2Connection:
         }
         self._send(body)
 
-    def send_request(self, method: str, params):
-        rid = self._next_id
-        self._next_id += 1
+    def _new_id(self):
+        with self._id_lock:
+            rid = self._next_id
+            self._next_id += 1
+        return rid
+
+    def _request(self, method: str, params):
+        """Sends a request and returns its id and a Future for its
+        response."""
+        rid = self._new_id()
+        future = Future()
+        self._start_reader()
+        with self._pending_lock:
+            if self._closed:
+                future.set_exception(EOFError())
+                return rid, future
+            self._pending[rid] = future
         body = {
             "jsonrpc": "2.0",
             "id": rid,
@@ -136,7 +237,17 @@ class JSONRPC2Connection:
             "params": params,
         }
         self._send(body)
-        return self.read_message(want=lambda msg: msg.get("id") == rid)
+        return rid, future
+
+    def _cancel_request(self, rid):
+        """Stops waiting for the response to request rid; it's dropped when
+        it arrives."""
+        with self._pending_lock:
+            self._pending.pop(rid, None)
+
+    def send_request(self, method: str, params):
+        _, future = self._request(method, params)
+        return future.result()
 
     def send_notification(self, method: str, params):
         body = {
@@ -146,52 +257,24 @@ class JSONRPC2Connection:
         }
         self._send(body)
 
-    def send_request_batch(self, requests):
+    def send_request_batch(self, requests, window=100):
         """Pipelines requests and returns responses.
 
         The responses is a generator where the nth response corresponds
-        with the nth request. Users must read the generator until the
-        end, otherwise you will leak a thread.
+        with the nth request. At most window requests are outstanding
+        at any time. Closing the generator early stops sending the
+        remaining requests.
         """
-
-        # We communicate the request ids using a thread safe queue.
-        # It also allows us to bound the number of concurrent requests.
-        q = queue.Queue(100)
-
-        def send():
+        in_flight = deque()
+        try:
             for method, params in requests:
-                rid = self._next_id
-                self._next_id += 1
-                q.put(rid)
-                body = {
-                    "jsonrpc": "2.0",
-                    "id": rid,
-                    "method": method,
-                    "params": params,
-                }
-                self._send(body)
-
-            # Sentinel value to indicate we are done
-            q.put(None)
-
-        threading.Thread(target=send).start()
-
-        while True:
-            rid = q.get()
-            if rid is None:
-                break
-            yield self.read_message(want=lambda msg: msg.get("id") == rid)
-
-
-def deque_find_and_pop(d, f):
-    idx = None
-    for i, v in enumerate(d):
-        if f(v):
-            idx = i
-            break
-    if idx is None:
-        return None
-    d.rotate(-idx)
-    v = d.popleft()
-    d.rotate(idx)
-    return v
+                in_flight.append(self._request(method, params))
+                if len(in_flight) >= window:
+                    _, future = in_flight.popleft()
+                    yield future.result()
+            while in_flight:
+                _, future = in_flight.popleft()
+                yield future.result()
+        finally:
+            for rid, _ in in_flight:
+                self._cancel_request(rid)
@@ -1,18 +1,24 @@
 import logging
 import socketserver
+import concurrent.futures
+import contextlib
 import sys
 import os
+import threading
 import traceback
 
+import jedi
 import lightstep
 import opentracing
 
+from .cancellation import CancellationToken, RequestCancelled, wait
 from .config import GlobalConfig
 from .fs import LocalFileSystem, RemoteFileSystem
-from .jedi import RemoteJedi
+from .index_cache import FileIndexCache
+from .jedi import RemoteJedi, ScriptCache
 from .jsonrpc import JSONRPC2Connection, ReadWriter, TCPReadWriter
-from .workspace import Workspace
-from .symbols import extract_symbols, workspace_symbols
+from .workspace import Workspace, load_stdlib_index
+from .symbols import SymbolIndex, extract_symbols, workspace_symbols
 from .definitions import targeted_symbol
 from .references import get_references
 
@@ -32,19 +38,69 @@ class LangServer:
         self.running = True
         self.root_path = None
         self.fs = None
-        self.all_symbols = None
+        # a Future for the workspace's SymbolIndex (see get_symbol_index)
+        self.symbol_index = None
+        self.symbol_index_lock = threading.Lock()
         self.workspace = None
+        self.remote_jedi = None
+        self.scripts = None
         self.streaming = True
+        # cancellation tokens of the requests currently queued or being
+        # served, keyed by request id
+        self.cancellation_tokens = {}
+        self.cancellation_lock = threading.Lock()
 
     def run(self):
-        while self.running:
-            try:
-                request = self.conn.read_message()
-                self.handle(request)
-            except EOFError:
-                break
-            except Exception as e:
-                log.error("Unexpected error: %s", e, exc_info=True)
+        # Messages are read on this thread and handled on a pool of workers,
+        # so that a slow request (e.g. one that has to fetch a dependency)
+        # doesn't hold up the ones queued behind it.
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=GlobalConfig.REQUEST_WORKERS) as pool:
+            while self.running:
+                try:
+                    request = self.conn.read_message()
+                except EOFError:
+                    break
+                except Exception as e:
+                    log.error("Unexpected error: %s", e, exc_info=True)
+                    continue
+
+                if "id" in request:
+                    # register the token before the request is queued, so
+                    # it can be cancelled before a worker picks it up
+                    request["token"] = self.new_cancellation_token(
+                        request["id"])
+
+                method = request.get("method")
+                if method in ("initialize", "$/cancelRequest"):
+                    # every other request depends on the workspace that
+                    # initialize sets up, and a cancellation mustn't wait
+                    # behind the requests it's cancelling
+                    self.handle_safely(request)
+                elif method == "exit":
+                    # let in-flight requests finish before the workspace is
+                    # torn down
+                    pool.shutdown(wait=True)
+                    self.handle_safely(request)
+                    break
+                else:
+                    pool.submit(self.handle_safely, request)
+
+    def handle_safely(self, request):
+        try:
+            self.handle(request)
+        except Exception as e:
+            log.error("Unexpected error: %s", e, exc_info=True)
+        finally:
+            if "id" in request:
+                with self.cancellation_lock:
+                    self.cancellation_tokens.pop(request["id"], None)
+
+    def new_cancellation_token(self, rid):
+        token = CancellationToken()
+        with self.cancellation_lock:
+            self.cancellation_tokens[rid] = token
+        return token
 
     def handle(self, request):
         if "meta" in request and isinstance(
@@ -56,8 +112,12 @@ class LangServer:
 
         with opentracing.tracer.start_span(
                 request.get("method", "UNKNOWN"),
-                child_of=span_context) as span:
+                child_of=span_context) as span, \
+                contextlib.ExitStack() as resources:
             request["span"] = span
+            # whatever the handler holds on to until the response is sent
+            # (e.g. a cached Jedi Script)
+            request["resources"] = resources
             self.route_and_respond(request)
 
     def route_and_respond(self, request):
@@ -77,7 +137,7 @@ class LangServer:
             "workspace/symbol": self.serve_symbols,
             "workspace/xpackages": self.serve_x_packages,
             "workspace/xdependencies": self.serve_x_dependencies,
-            "$/cancelRequest": noop,
+            "$/cancelRequest": self.serve_cancel_request,
             "shutdown": noop,
             "exit": self.serve_exit,
         }.get(request["method"], self.serve_default)
@@ -92,12 +152,23 @@ class LangServer:
             return
 
         try:
+            token = request.get("token")
+            if token:
+                # it may have been cancelled while it was queued
+                token.check()
             resp = handler(request)
+        except RequestCancelled:
+            log.info("REQUEST %s cancelled", request["id"])
+            self.mark_failed(request)
+            self.conn.write_error(
+                request["id"], code=-32800, message="request cancelled")
         except JSONRPC2Error as e:
+            self.mark_failed(request)
             self.conn.write_error(
                 request["id"], code=e.code, message=e.message, data=e.data)
         except Exception as e:
             log.warning("handler for %s failed", request, exc_info=True)
+            self.mark_failed(request)
             self.conn.write_error(
                 request["id"],
                 code=-32603,
@@ -111,9 +182,30 @@ class LangServer:
                     request["span"], "send_response"):
                 self.conn.write_response(request["id"], resp)
 
-    def new_script(self, *args, **kwargs):
-        return RemoteJedi(self.fs, self.workspace, self.root_path).new_script(
-            *args, **kwargs)
+    def new_script(self, *args, request=None, **kwargs):
+        """Returns a Jedi Script for the given path and position.
+
+        If request is given, the Script comes from the session's
+        ScriptCache and goes back into it once the response has been sent,
+        unless the request failed (see mark_failed).
+        """
+        if request is not None and request.get("resources") is not None \
+                and self.scripts is not None:
+            return request["resources"].enter_context(self.scripts.checkout(
+                failed=lambda: request.get("failed", False), **kwargs))
+        if self.remote_jedi is None:
+            # e.g. a server whose fs and root path were set up directly,
+            # without an initialize request
+            self.remote_jedi = RemoteJedi(self.fs, self.workspace,
+                                          self.root_path)
+        return self.remote_jedi.new_script(*args, **kwargs)
+
+    @staticmethod
+    def mark_failed(request):
+        """Keeps the Script the request checked out of the ScriptCache from
+        being reused. Jedi memoizes its inference as it goes, so an error
+        in the middle of it leaves the Script's results incomplete."""
+        request["failed"] = True
 
     @staticmethod
     def goto_assignments(script, request):
@@ -122,10 +214,13 @@ class LangServer:
             with opentracing.start_child_span(
                     parent_span, "Script.goto_assignments"):
                 return script.goto_assignments()
+        except RequestCancelled:
+            raise
         except Exception as e:
             # TODO return these errors using JSONRPC properly. Doing it
             # this way initially for debugging purposes.
             log.error("Failed goto_assignments for %s", request, exc_info=True)
+            LangServer.mark_failed(request)
             parent_span.log_kv(
                 {"error", "Failed goto_assignments for %s" % request})
         return []
@@ -137,10 +232,13 @@ class LangServer:
             with opentracing.start_child_span(
                     parent_span, "Script.goto_definitions"):
                 return script.goto_definitions()
+        except RequestCancelled:
+            raise
         except Exception as e:
             # TODO return these errors using JSONRPC properly. Doing it
             # this way initially for debugging purposes.
             log.error("Failed goto_definitions for %s", request, exc_info=True)
+            LangServer.mark_failed(request)
             parent_span.log_kv(
                 {"error", "Failed goto_definitions for %s" % request})
         return []
@@ -177,6 +275,10 @@ class LangServer:
         originalRootUri = params.get("originalRootUri") or params.get(
             "originalRootPath") or ""
         self.workspace = Workspace(self.fs, self.root_path, originalRootUri, pip_args)
+        self.remote_jedi = RemoteJedi(self.fs, self.workspace, self.root_path)
+        self.scripts = ScriptCache(self.remote_jedi)
+        if GlobalConfig.PREFETCH_WORKERS:
+            self.start_prefetching()
 
         return {
             "capabilities": {
@@ -191,6 +293,22 @@ class LangServer:
             }
         }
 
+    def start_prefetching(self):
+        """Starts fetching the workspace's likely dependencies in the
+        background, so the first requests that need them don't have to
+        wait for the downloads."""
+        workspace = self.workspace
+
+        def prefetch():
+            with opentracing.tracer.start_span("prefetch") as span:
+                try:
+                    workspace.prefetch_dependencies(span)
+                except Exception:
+                    log.warning("Unable to prefetch dependencies",
+                                exc_info=True)
+
+        threading.Thread(target=prefetch, daemon=True).start()
+
     # TODO(aaron): find a better way to create a langserver/workspace that
     # uses a TestFileSystem
     def test_initialize(self, request, fs):
@@ -201,6 +319,8 @@ class LangServer:
         self.streaming = False
         self.workspace = Workspace(self.fs, self.root_path,
                                    params["originalRootPath"])
+        self.remote_jedi = RemoteJedi(self.fs, self.workspace, self.root_path)
+        self.scripts = ScriptCache(self.remote_jedi)
 
         return {
             "capabilities": {
@@ -226,7 +346,9 @@ class LangServer:
             source=source,
             line=pos["line"] + 1,
             column=pos["character"],
-            parent_span=parent_span)
+            parent_span=parent_span,
+            token=request.get("token"),
+            request=request)
 
         # get the Jedi Definition instances from which to extract the hover
         # information. We filter out string literal Definitions
@@ -267,7 +389,10 @@ class LangServer:
                     'param': 'variable',
                 }
                 return basic_types.get(definition.type, definition.type)
+            except RequestCancelled:
+                raise
             except Exception:
+                LangServer.mark_failed(request)
                 return 'builtin'
 
         results = []
@@ -280,7 +405,10 @@ class LangServer:
                     signature = generate_signature(definition)
                     try:
                         description = definition.docstring(raw=True).strip()
+                    except RequestCancelled:
+                        raise
                     except Exception:
+                        LangServer.mark_failed(request)
                         description = ''
                     if not description and not hasattr(definition,
                                                        'get_line_code'):
@@ -290,7 +418,10 @@ class LangServer:
                     try:
                         signature = definition.full_name
                         description = definition.docstring(raw=True).strip()
+                    except RequestCancelled:
+                        raise
                     except Exception:
+                        LangServer.mark_failed(request)
                         description = ''
                     if not description and hasattr(definition,
                                                    'get_line_code'):
@@ -342,7 +473,9 @@ class LangServer:
             source=source,
             line=pos["line"] + 1,
             column=pos["character"],
-            parent_span=parent_span)
+            parent_span=parent_span,
+            token=request.get("token"),
+            request=request)
 
         results = []
         defs = []
@@ -500,7 +633,9 @@ class LangServer:
             source=source,
             line=pos["line"] + 1,
             column=pos["character"],
-            parent_span=parent_span)
+            parent_span=parent_span,
+            token=request.get("token"),
+            request=request)
 
         usages = LangServer.usages(script, parent_span)
         if len(usages) == 0:
@@ -588,8 +723,13 @@ class LangServer:
         # easier to manually parse the source files and search the ASTs. We can still use Jedi to
         # eliminate false positives by ensuring that each returned reference has a definition that
         # matches the symbol descriptor.
+        token = request.get("token")
+        # only the files that import the package can refer to the symbol
+        paths = self.workspace.get_import_graph(
+            parent_span, token).files_importing(package_name)
         for ref_batch in get_references(package_name, symbol_name, self.fs,
-                                        self.root_path, parent_span):
+                                        self.root_path, parent_span, token,
+                                        paths):
             json_patch = []
             for r in ref_batch:
                 location = {
@@ -637,18 +777,50 @@ class LangServer:
             return targeted_symbol(params["symbol"], self.fs, self.root_path,
                                    parent_span)
 
-        if self.all_symbols is None:
-            self.all_symbols = workspace_symbols(self.fs, self.root_path,
-                                                 parent_span)
-
-        q, limit = params.get("query"), params.get("limit", 50)
-        symbols = ((sym.score(q), sym) for sym in self.all_symbols)
-        symbols = ((score, sym) for (score, sym) in symbols if score >= 0)
-        symbols = sorted(symbols, reverse=True, key=lambda x: x[0])[:limit]
+        with opentracing.start_child_span(parent_span,
+                                          "wait_for_symbol_index"):
+            index = wait(self.get_symbol_index(), request.get("token"))
+        q, limit = params.get("query") or "", params.get("limit", 50)
+        symbols = index.search(q, limit)
 
-        result = [s.json_object() for (_, s) in symbols]
+        result = [s.json_object() for s in symbols]
         return result
 
+    def get_symbol_index(self) -> concurrent.futures.Future:
+        """Returns a Future for the workspace's SymbolIndex, starting to build
+        it in the background on first use.
+
+        The build isn't tied to the request that started it, so it
+        carries on (and is saved to the index cache) even if that request
+        is cancelled.
+        """
+        with self.symbol_index_lock:
+            if self.symbol_index is None:
+                self.symbol_index = concurrent.futures.Future()
+                threading.Thread(target=self.build_symbol_index,
+                                 args=(self.symbol_index,),
+                                 daemon=True).start()
+            return self.symbol_index
+
+    def build_symbol_index(self, future: concurrent.futures.Future):
+        with opentracing.tracer.start_span("build_symbol_index") as span:
+            try:
+                cache = None
+                if self.workspace.repo_key:
+                    cache = FileIndexCache("symbols", self.workspace.repo_key,
+                                           self.workspace.hash)
+                all_symbols = workspace_symbols(self.fs, self.root_path, span,
+                                                cache=cache)
+                index = SymbolIndex(all_symbols)
+            except Exception as e:
+                log.error("Unable to build symbol index", exc_info=True)
+                # let the next request try again
+                with self.symbol_index_lock:
+                    self.symbol_index = None
+                future.set_exception(e)
+            else:
+                future.set_result(index)
+
     def serve_document_symbols(self, request):
         params = request["params"]
         path = path_from_uri(params["textDocument"]["uri"])
@@ -657,12 +829,28 @@ class LangServer:
         return [s.json_object() for s in extract_symbols(source, path)]
 
     def serve_x_packages(self, request):
-        return self.workspace.get_package_information(request["span"])
+        return self.workspace.get_package_information(request["span"],
+                                                      request.get("token"))
 
     def serve_x_dependencies(self, request):
-        return self.workspace.get_dependencies(request["span"])
+        return self.workspace.get_dependencies(request["span"],
+                                               request.get("token"))
+
+    def serve_cancel_request(self, request):
+        rid = request["params"]["id"]
+        with self.cancellation_lock:
+            token = self.cancellation_tokens.get(rid)
+        if token:
+            token.cancel()
 
     def serve_exit(self, request):
+        if isinstance(self.fs, RemoteFileSystem):
+            log.info("Content cache: %d hits, %d misses, %d bytes",
+                     self.fs.cache.hits, self.fs.cache.misses,
+                     self.fs.cache.size)
+        if self.scripts is not None:
+            log.info("Script cache: %d hits, %d misses", self.scripts.hits,
+                     self.scripts.misses)
         self.workspace.cleanup()
         self.running = False
 
@@ -683,6 +871,25 @@ class ForkingTCPServer(socketserver.ForkingMixIn, socketserver.TCPServer):
     pass
 
 
+def prewarm():
+    """Builds the standard library index and parses commonly used standard
+    library modules up front.
+
+    When this runs in the TCP server's parent process, each forked
+    connection inherits the results copy-on-write instead of building
+    them itself.
+    """
+    log.info("Prewarming standard library index for %s",
+             GlobalConfig.PYTHON_PATH)
+    if os.path.exists(GlobalConfig.PYTHON_PATH):
+        load_stdlib_index(GlobalConfig.PYTHON_PATH)
+    try:
+        jedi.preload_module(*GlobalConfig.PREWARM_MODULES)
+    except Exception:
+        log.warning("Unable to preload standard library modules",
+                    exc_info=True)
+
+
 class LangserverTCPTransport(socketserver.StreamRequestHandler):
     def handle(self):
         conn = JSONRPC2Connection(TCPReadWriter(self.rfile, self.wfile))
@@ -701,6 +908,19 @@ def main():
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--lightstep_token", default=os.environ.get("LIGHTSTEP_ACCESS_TOKEN"))
     parser.add_argument("--python_path")
+    parser.add_argument(
+        "--workers", default=GlobalConfig.REQUEST_WORKERS, type=int,
+        help="number of requests handled concurrently per connection")
+    parser.add_argument(
+        "--parse_workers", default=GlobalConfig.PARSE_WORKERS, type=int,
+        help="number of processes parsing source files (default: one per CPU)")
+    parser.add_argument(
+        "--prefetch_workers", default=GlobalConfig.PREFETCH_WORKERS, type=int,
+        help="number of dependencies downloaded at once in the background "
+        "after initialize (default: 0, only fetch them when needed)")
+    parser.add_argument(
+        "--prewarm", action="store_true",
+        help="build the standard library index before accepting connections (tcp)")
 
     args = parser.parse_args()
 
@@ -711,6 +931,10 @@ def main():
 
     log.info("Setting Python path to %s", GlobalConfig.PYTHON_PATH)
 
+    GlobalConfig.REQUEST_WORKERS = args.workers
+    GlobalConfig.PARSE_WORKERS = args.parse_workers
+    GlobalConfig.PREFETCH_WORKERS = args.prefetch_workers
+
     # if args.lightstep_token isn't set, we'll fall back on the default no-op
     # opentracing implementation
     if args.lightstep_token:
@@ -720,10 +944,14 @@ def main():
 
     if args.mode == "stdio":
         logging.info("Reading on stdin, writing on stdout")
-        s = LangServer(conn=ReadWriter(sys.stdin, sys.stdout))
+        conn = JSONRPC2Connection(
+            ReadWriter(sys.stdin.buffer, sys.stdout.buffer))
+        s = LangServer(conn)
         s.run()
     elif args.mode == "tcp":
         host, addr = "0.0.0.0", args.addr
+        if args.prewarm:
+            prewarm()
         logging.info("Accepting TCP connections on %s:%s", host, addr)
         ForkingTCPServer.allow_reuse_address = True
         ForkingTCPServer.daemon_threads = True
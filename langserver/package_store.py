@@ -0,0 +1,306 @@
+"""A store of downloaded packages, shared by every session on this machine.
+
+Each version of a package is downloaded and unpacked once, into
+PACKAGE_STORE_PATH/<name>-<version>. The store also remembers which
+version each requirement (e.g. an unpinned "requests") resolved to, so pip
+isn't run for it again until PACKAGE_RESOLUTION_TTL has passed.
+Workspaces see the packages they use through symlinks in their own package
+folder (see link_into), so cleaning up a workspace leaves the store intact.
+
+Sessions (possibly in other processes) register themselves as users of
+the entries they link to. Once the store grows beyond PACKAGE_STORE_SIZE,
+the least recently used entries without any live users are evicted.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import List
+
+from . import fetch
+from .config import GlobalConfig
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = (".whl", ".zip", ".tar.gz", ".tar.bz2")
+
+
+def normalize_name(name: str) -> str:
+    """Normalizes a project name as described in PEP 503."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def pinned_version(specifier: str):
+    """Returns the version that specifier pins (e.g. "1.2" for "==1.2"), or
+    None if it allows more than one."""
+    if specifier.startswith("==") and not any(c in specifier for c in ",*"):
+        return specifier[2:].strip()
+    return None
+
+
+def archive_key(filename: str) -> str:
+    """Returns the store key for a file or folder downloaded by pip, e.g.
+    "requests-2.18.4" for "requests-2.18.4-py2.py3-none-any.whl"."""
+    stem = filename
+    for ext in ARCHIVE_EXTENSIONS:
+        if filename.endswith(ext):
+            stem = filename[:-len(ext)]
+            break
+    if filename.endswith(".whl"):
+        name, version = stem.split("-")[:2]
+    elif "-" in stem:
+        name, version = stem.rsplit("-", 1)
+    else:
+        return normalize_name(stem)
+    return "{}-{}".format(normalize_name(name), version)
+
+
+class PackageStore:
+    def __init__(self, root: str, max_size: int):
+        """
+        :param root: the folder holding the unpacked packages
+        :param max_size: the size (in bytes) beyond which unused packages are evicted
+        """
+        self.root = root
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _users(self, key: str) -> str:
+        return os.path.join(self.root, ".users", key)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Excludes other threads and processes from adding users to entries
+        and evicting them."""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(os.path.join(self.root, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def fetch(self, name: str, specifier: str, pip_args: List[str],
+              user: str) -> List[str]:
+        """Returns the paths of the store entries holding the named package,
+        downloading and unpacking it first if necessary, and registers user
+        as a user of them until it calls release.
+
+        :param user: identifies the session, and must start with its pid followed by "-"
+        """
+        keys = self._resolved_keys(name, specifier, pip_args)
+        version = pinned_version(specifier)
+        if keys is None and version is not None:
+            keys = ["{}-{}".format(normalize_name(name), version)]
+        if keys:
+            with self._locked():
+                if all(os.path.isdir(self._entry(key)) for key in keys):
+                    log.info("Using stored package %s", ", ".join(keys))
+                    for key in keys:
+                        self._acquire(key, user)
+                    return [self._entry(key) for key in keys]
+
+        keys = []
+        os.makedirs(self.root, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.root,
+                                         prefix=".download-") as folder:
+            if not fetch.download(name, specifier, folder, pip_args):
+                return []
+            for thing in os.listdir(folder):
+                key = archive_key(thing)
+                if not os.path.isdir(self._entry(key)):
+                    self._add(key, os.path.join(folder, thing))
+                keys.append(key)
+        self._resolved(name, specifier, pip_args, keys)
+
+        entries = []
+        with self._locked():
+            for key in keys:
+                # it may have been evicted again already
+                if os.path.isdir(self._entry(key)):
+                    self._acquire(key, user)
+                    entries.append(self._entry(key))
+            self._evict()
+        return entries
+
+    def release(self, entry: str, user: str):
+        """Unregisters user as a user of entry."""
+        key = os.path.basename(entry)
+        with self._locked():
+            try:
+                os.unlink(os.path.join(self._users(key), user))
+            except FileNotFoundError:
+                pass
+
+    def _resolution(self, name: str, specifier: str,
+                    pip_args: List[str]) -> str:
+        digest = hashlib.sha1(
+            "\0".join([specifier] + list(pip_args)).encode()).hexdigest()
+        return os.path.join(self.root, ".resolved", "{}-{}".format(
+            normalize_name(name), digest[:16]))
+
+    def _resolved_keys(self, name: str, specifier: str, pip_args: List[str]):
+        """Returns the keys of the entries that the last download of name
+        and specifier produced, or None if there's been no download
+        within PACKAGE_RESOLUTION_TTL."""
+        path = self._resolution(name, specifier, pip_args)
+        try:
+            if time.time() - os.stat(path).st_mtime > \
+                    GlobalConfig.PACKAGE_RESOLUTION_TTL:
+                return None
+            with open(path) as f:
+                return f.read().split()
+        except FileNotFoundError:
+            return None
+
+    def _resolved(self, name: str, specifier: str, pip_args: List[str],
+                  keys: List[str]):
+        path = self._resolution(name, specifier, pip_args)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(keys))
+        os.replace(tmp_path, path)
+
+    def _add(self, key: str, thing_abs: str):
+        tmp_path = tempfile.mkdtemp(dir=self.root, prefix=".unpack-")
+        fetch.unpack(thing_abs, tmp_path)
+        with open(self._entry(key) + ".size", "w") as f:
+            f.write(str(_disk_usage(tmp_path)))
+        try:
+            # rename into place, so no one ever sees a partial entry
+            os.rename(tmp_path, self._entry(key))
+        except OSError:
+            # another session stored it first
+            shutil.rmtree(tmp_path, True)
+
+    def _acquire(self, key: str, user: str):
+        os.makedirs(self._users(key), exist_ok=True)
+        open(os.path.join(self._users(key), user), "w").close()
+        # the entry's mtime records when it was last used
+        os.utime(self._entry(key))
+
+    def _in_use(self, key: str) -> bool:
+        try:
+            users = os.listdir(self._users(key))
+        except FileNotFoundError:
+            return False
+        in_use = False
+        for user in users:
+            if _is_alive(int(user.split("-", 1)[0])):
+                in_use = True
+            else:
+                # left behind by a session that died without cleaning up
+                os.unlink(os.path.join(self._users(key), user))
+        return in_use
+
+    def _evict(self):
+        entries = []
+        for key in os.listdir(self.root):
+            if key.startswith(".") or not os.path.isdir(self._entry(key)):
+                continue
+            try:
+                with open(self._entry(key) + ".size") as f:
+                    size = int(f.read())
+            except (OSError, ValueError):
+                size = _disk_usage(self._entry(key))
+            entries.append((os.stat(self._entry(key)).st_mtime, key, size))
+
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            if self._in_use(key):
+                continue
+            log.info("Evicting stored package %s", key)
+            trash_path = tempfile.mkdtemp(dir=self.root, prefix=".evict-")
+            os.rename(self._entry(key), os.path.join(trash_path, key))
+            shutil.rmtree(trash_path, True)
+            _unlink_if_exists(self._entry(key) + ".size")
+            shutil.rmtree(self._users(key), True)
+            total -= size
+
+
+def link_into(entry: str, view_path: str):
+    """Makes the contents of a store entry visible in view_path (a
+    workspace's package folder) through symlinks.
+
+    Folders that several packages share (e.g. namespace packages) are
+    merged, like unpacking the packages into the same folder would.
+    """
+    # PACKAGE_STORE_PATH is usually relative to the working directory
+    entry = os.path.abspath(entry)
+    for name in os.listdir(entry):
+        _link(os.path.join(entry, name), os.path.join(view_path, name))
+
+
+def _link(src: str, dst: str):
+    if not os.path.lexists(dst):
+        os.symlink(src, dst)
+    elif os.path.isdir(src) and os.path.isdir(dst):
+        if os.path.islink(dst):
+            # split the linked folder into a real one, so we can add to it
+            target = os.path.realpath(dst)
+            os.unlink(dst)
+            os.mkdir(dst)
+            link_into(target, dst)
+        link_into(src, dst)
+    elif not os.path.isdir(dst):
+        # the later package wins, as when unpacking over an existing file
+        os.unlink(dst)
+        os.symlink(src, dst)
+    else:
+        log.warning("Not replacing folder %s with %s", dst, src)
+
+
+def _disk_usage(path: str) -> int:
+    size = 0
+    for folder, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(folder, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _unlink_if_exists(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> PackageStore:
+    """Returns the package store, as configured by GlobalConfig."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PackageStore(GlobalConfig.PACKAGE_STORE_PATH,
+                                  GlobalConfig.PACKAGE_STORE_SIZE)
+        return _store
@@ -0,0 +1,101 @@
+"""A process-wide pool of worker processes for parsing source files.
+
+Creating a multiprocessing.Pool per request means forking (and, with
+the spawn start method, re-importing everything) on every call, and
+concurrent requests each bring a pool of their own. Instead, every
+caller submits its work to one long-lived pool, started when it's first
+needed, so sessions that never parse anything don't pay for it.
+
+The pool's workers are forked from a forkserver process rather than
+from the server itself, which by then is running the reader and request
+threads: a child forked from a threaded process can inherit locks that
+those threads hold.
+
+Callers submit work with map_unordered rather than Pool.imap_unordered.
+The pool feeds imap inputs to its workers from a single thread, one job
+at a time. One request's input generator (which typically reads files
+from the remote fs) would then hold up every other request's work
+until it was exhausted.
+"""
+
+import atexit
+import itertools
+import multiprocessing.pool
+import os
+import queue
+import threading
+
+from .config import GlobalConfig
+
+# the modules whose functions the workers run, imported once by the
+# forkserver instead of by every worker
+PRELOAD = ["langserver.imports", "langserver.references", "langserver.symbols"]
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> multiprocessing.pool.Pool:
+    """Returns the parse worker pool, starting it if necessary."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # A pool inherited from our parent (e.g. by a forked TCP connection
+        # handler) doesn't have any workers in this process.
+        if _pool is None or _pool_pid != os.getpid():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(PRELOAD)
+            _pool = context.Pool(GlobalConfig.PARSE_WORKERS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def map_unordered(func, iterable, token=None, chunksize=10, window=None):
+    """Yields func(item) for each item of iterable, computed in the pool, in
+    order of completion.
+
+    iterable is consumed on the calling thread, and submitted in chunks of
+    chunksize items with at most window chunks outstanding at a time, so
+    that concurrent callers' work is interleaved in the pool. Once token is
+    cancelled (or the generator is closed), no more chunks are submitted.
+    """
+    pool = get_pool()
+    if window is None:
+        window = 2 * (GlobalConfig.PARSE_WORKERS or os.cpu_count() or 1)
+    items = iter(iterable)
+    completed = queue.Queue()
+    outstanding = 0
+    exhausted = False
+    while True:
+        while not exhausted and outstanding < window:
+            chunk = list(itertools.islice(items, chunksize))
+            if not chunk or (token and token.is_cancelled()):
+                exhausted = True
+                break
+            pool.apply_async(_apply_chunk, (func, chunk),
+                             callback=completed.put,
+                             error_callback=lambda e: completed.put(_Failed(e)))
+            outstanding += 1
+        if not outstanding:
+            return
+        results = completed.get()
+        outstanding -= 1
+        if isinstance(results, _Failed):
+            raise results.error
+        yield from results
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def _apply_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+@atexit.register
+def _shutdown():
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.terminate()
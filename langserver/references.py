@@ -1,6 +1,9 @@
 """This module is used for x-references."""
 
 import ast
+import re
+
+from .parse_pool import map_unordered
 
 
 class ReferenceFilteringVisitor(ast.NodeVisitor):
@@ -64,30 +67,82 @@ class ReferenceFindingVisitor(ast.NodeVisitor):
                     {"line": node.lineno - 1, "character": node.col_offset, "path": self.path})
 
 
-def get_references(module_name, symbol_name, fs, root_path, parent_span):
-    for path, tree in filter_for_references(
-            module_name, fs, root_path, parent_span):
-        v = ReferenceFindingVisitor(symbol_name, path)
-        v.visit(tree)
-        if v.results:
-            yield v.results
+def get_references(module_name, symbol_name, fs, root_path, parent_span,
+                   token=None, paths=None):
+    """Yields lists of the references to symbol_name in each of the files
+    under root_path that import module_name, as the files are scanned.
+
+    Files are parsed and searched in the parse worker pool, so results
+    come back in order of completion rather than file order. If paths is
+    given (e.g. from ImportGraph.files_importing), only those files are
+    searched.
+    """
+    for refs in _map_sources(_imap_find_references, (module_name, symbol_name),
+                             fs, root_path, parent_span, token,
+                             _import_screen(module_name), paths):
+        if refs:
+            yield refs
+
 
+def _map_sources(func, args, fs, root_path, parent_span, token, screen=None,
+                 py_paths=None):
+    """Reads every Python file under root_path (or just py_paths, if given)
+    and yields the results of calling func((*args, path, source)) for each
+    of them in the parse worker pool, in order of completion.
 
-def filter_for_references(name, fs, root_path, parent_span):
-    py_paths = (path for path in fs.walk(root_path) if path.endswith(".py"))
+    If screen is given, files whose source it doesn't match are skipped
+    without being sent to the pool.
+    """
+    if py_paths is None:
+        py_paths = (path for path in fs.walk(root_path)
+                    if path.endswith(".py"))
+
+    # The remote reads are pipelined, so they overlap with the parsing in
+    # the worker processes
+    py_srces = fs.batch_open(py_paths, parent_span)
+
+    if screen is not None:
+        py_srces = ((path, source) for path, source in py_srces
+                    if screen.search(source))
+
+    # if our caller stops early (e.g. on reaching its limit), closing this
+    # generator stops reading files and feeding them to the pool
+    results = map_unordered(
+        func, (args + (path, source) for path, source in py_srces), token)
+    for result in results:
+        if token:
+            token.check()
+        yield result
+    if token:
+        # a cancelled request may have stopped feeding the pool early
+        token.check()
+
+
+# This exists purely for passing into imap
+def _imap_find_references(args):
+    module_name, symbol_name, path, source = args
+    tree = _filter(module_name, source)
+    if not tree:
+        return None
+    v = ReferenceFindingVisitor(symbol_name, path)
+    v.visit(tree)
+    return v.results
 
-    py_srces = ((path, fs.open(path, parent_span)) for path in py_paths)
 
-    # py_srces = fs.batch_open(py_paths, parent_span)
+def _import_screen(name):
+    """Returns a regex matching the sources that could possibly import the
+    package name.
 
-    for path_and_source in py_srces:
-        path, source = path_and_source
-        tree = _filter(name, source)
-        if tree:
-            yield path, tree
+    A file can't import name without mentioning it as a word, and
+    searching for it is far cheaper than parsing the file, which only a
+    small fraction of files survive to need.
+    """
+    return re.compile(r"\b{}\b".format(re.escape(name)))
 
 
 def _filter(name, source):
+    # _map_sources has already screened out the sources that can't import
+    # name
     try:
         tree = ast.parse(source)
     except SyntaxError:
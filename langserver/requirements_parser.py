@@ -1,3 +1,5 @@
+import json
+
 from requirements import parse
 
 
@@ -24,6 +26,27 @@ def parse_requirements(req_path, file_system):
     return {req.name: req.specs for req in requirements if req.specifier}
 
 
+def parse_pipfile_lock(lock_path, file_system):
+    """Parses the Pipfile.lock located at lock_path. Returns a map of package
+    names to their version specifiers, like parse_requirements.
+
+    :param lock_path: the path to the Pipfile.lock. Throws a FileNotFound or a
+    FileException if lock_path is not valid, and a ValueError if it isn't valid JSON
+
+    :param file_system: the file system to use to open the file @ lock_path
+
+    Only the (non-dev) "default" packages are included, and packages that aren't pinned
+    to a version (e.x. ones installed from a VCS URL or a local path) are ignored.
+    """
+    lock = json.loads(file_system.open(lock_path))
+    specifiers = {}
+    for name, info in lock.get("default", {}).items():
+        version = info.get("version", "")
+        if version.startswith("=="):
+            specifiers[name] = [("==", version[2:])]
+    return specifiers
+
+
 def get_version_specifier_for_pkg(pkg, pkg_specifiers_map):
     """Returns the specifier string to use for a given requirement. If pkg has
     no corresponding entry in the pkg_specifiers_map, a string representing
@@ -0,0 +1,78 @@
+"""This module persists the standard library module index on disk.
+
+Walking the whole standard library takes a good fraction of a second
+(more on slow disks), and the result only changes when the interpreter
+does, so we build it once and load it on later startups.
+"""
+
+import hashlib
+import logging
+import os
+import os.path
+import pickle
+import sys
+import tempfile
+
+from .config import GlobalConfig
+
+log = logging.getLogger(__name__)
+
+# bump this whenever the row layout below changes
+FORMAT_VERSION = 1
+
+
+def cache_file(python_path: str) -> str:
+    key = hashlib.sha1(
+        "\0".join((python_path, sys.version)).encode()).hexdigest()[:16]
+    return os.path.join(GlobalConfig.STDLIB_INDEX_PATH,
+                        "stdlib-{}.pickle".format(key))
+
+
+def _fingerprint(python_path: str):
+    return (FORMAT_VERSION, python_path, sys.version,
+            os.stat(python_path).st_mtime_ns)
+
+
+def load(python_path: str):
+    """Returns the cached index rows for the standard library at
+    python_path, or None if there's no cache or it's stale.
+
+    Each row is a (qualified_name, name, relative_path, is_package,
+    is_native) tuple.
+    """
+    path = cache_file(python_path)
+    try:
+        with open(path, "rb") as f:
+            fingerprint, rows = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning("Ignoring unreadable stdlib index %s: %s", path, e)
+        return None
+    if fingerprint != _fingerprint(python_path):
+        log.info("Stdlib index %s is stale", path)
+        return None
+    return rows
+
+
+def save(python_path: str, rows):
+    """Writes the index rows for the standard library at python_path.
+
+    The file is written to a temporary name and renamed into place, so
+    concurrent sessions never see a partial index.
+    """
+    path = cache_file(python_path)
+    try:
+        os.makedirs(GlobalConfig.STDLIB_INDEX_PATH, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=GlobalConfig.STDLIB_INDEX_PATH)
+    except OSError as e:
+        log.warning("Unable to write stdlib index %s: %s", path, e)
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((_fingerprint(python_path), rows), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning("Unable to write stdlib index %s: %s", path, e)
+        os.unlink(tmp_path)
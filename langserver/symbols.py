@@ -1,10 +1,16 @@
 import ast
-import itertools
-import multiprocessing
+import bisect
+import heapq
 import logging
+import sys
 
+from array import array
+from collections import defaultdict
 from enum import Enum
 
+from .index_cache import content_hash
+from .parse_pool import map_unordered
+
 
 log = logging.getLogger(__name__)
 
@@ -33,6 +39,8 @@ class SymbolKind(Enum):
 
 
 class Symbol:
+    __slots__ = ("name", "kind", "line", "col", "container", "file")
+
     def __init__(self, name, kind, line, col, container=None, file=None):
         self.name = name
         self.kind = kind
@@ -102,6 +110,169 @@ class Symbol:
             d["containerName"] = self.container
         return d
 
+    def row(self):
+        """Returns the symbol as a compact tuple, without its file."""
+        return (self.name, self.kind.value, self.line, self.col,
+                self.container)
+
+
+class SymbolTable:
+    """A compact, column-oriented list of symbols.
+
+    A workspace can have hundreds of thousands of symbols, so instead of
+    a Symbol object per symbol we keep one column per attribute: names
+    as interned strings, kinds, lines and columns in arrays, and
+    containers and files as indexes into a table of distinct strings.
+    Symbol objects are only created when an entry is looked up.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.kinds = array("B")
+        self.lines = array("I")
+        self.cols = array("I")
+        # indexes into self.strings, or -1 for None
+        self.containers = array("i")
+        self.files = array("i")
+        self.strings = []
+        self._string_ids = {}
+
+    def __getstate__(self):
+        # the string ids are cheap to rebuild, so don't pickle them
+        state = self.__dict__.copy()
+        del state["_string_ids"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._string_ids = {s: i for i, s in enumerate(self.strings)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i) -> Symbol:
+        return Symbol(self.names[i], SymbolKind(self.kinds[i]), self.lines[i],
+                      self.cols[i], self.string(self.containers[i]),
+                      self.string(self.files[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def string(self, string_id: int):
+        return self.strings[string_id] if string_id >= 0 else None
+
+    def _string_id(self, s) -> int:
+        if s is None:
+            return -1
+        string_id = self._string_ids.get(s)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(s)
+            self._string_ids[s] = string_id
+        return string_id
+
+    def append(self, symbol: Symbol):
+        self.names.append(sys.intern(symbol.name))
+        self.kinds.append(symbol.kind.value)
+        self.lines.append(symbol.line)
+        self.cols.append(symbol.col)
+        self.containers.append(self._string_id(symbol.container))
+        self.files.append(self._string_id(symbol.file))
+
+    def extend_rows(self, rows, file: str):
+        """Appends symbols in the form returned by Symbol.row, all
+        defined in file."""
+        file_id = self._string_id(file)
+        for name, kind, line, col, container in rows:
+            self.names.append(sys.intern(name))
+            self.kinds.append(kind)
+            self.lines.append(line)
+            self.cols.append(col)
+            self.containers.append(self._string_id(container))
+            self.files.append(file_id)
+
+
+class SymbolIndex:
+    """An index over a SymbolTable for answering workspace/symbol
+    queries.
+
+    A symbol can only match a query (see Symbol.score) if the query is a
+    substring of its name, a prefix of its container or file, or its
+    qualified "container.name". The index finds those candidates
+    without looking at every symbol: substrings through a trigram index
+    of the lowercase names, prefixes through sorted tables of the
+    distinct lowercase containers and files. Only the candidates are
+    scored.
+    """
+
+    def __init__(self, symbols: SymbolTable):
+        self.symbols = symbols
+        self._names = [name.lower() for name in symbols.names]
+        self._trigrams = defaultdict(list)
+        for i, name in enumerate(self._names):
+            for trigram in {name[j:j + 3] for j in range(len(name) - 2)}:
+                self._trigrams[trigram].append(i)
+        strings = [s.lower() for s in symbols.strings]
+        containers = defaultdict(list)
+        files = defaultdict(list)
+        for i, (container_id, file_id) in enumerate(
+                zip(symbols.containers, symbols.files)):
+            if container_id >= 0 and strings[container_id]:
+                containers[strings[container_id]].append(i)
+            if file_id >= 0 and strings[file_id]:
+                files[strings[file_id]].append(i)
+        self._containers = dict(containers)
+        self._container_keys = sorted(containers)
+        self._files = dict(files)
+        self._file_keys = sorted(files)
+        self._by_base_score = None
+
+    def search(self, query: str, limit: int):
+        """Returns the limit best matches for query as Symbols, best first,
+        in the same order as scoring and sorting every symbol would."""
+        if not query:
+            if self._by_base_score is None:
+                # sorted is stable, so ties keep their original order
+                self._by_base_score = sorted(
+                    range(len(self.symbols)),
+                    key=lambda i: self.symbols[i].score(""), reverse=True)
+            return [self.symbols[i] for i in self._by_base_score[:limit]]
+
+        scored = ((self.symbols[i].score(query), self.symbols[i])
+                  for i in sorted(self._candidates(query.lower())))
+        scored = ((score, sym) for (score, sym) in scored if score >= 0)
+        return [sym for (_, sym) in
+                heapq.nlargest(limit, scored, key=lambda x: x[0])]
+
+    def _candidates(self, l_query: str):
+        candidates = set()
+
+        if len(l_query) < 3:
+            candidates.update(i for i, name in enumerate(self._names)
+                              if l_query in name)
+        else:
+            postings = [self._trigrams.get(l_query[j:j + 3], ())
+                        for j in range(len(l_query) - 2)]
+            shortest = min(postings, key=len)
+            candidates.update(i for i in shortest if l_query in self._names[i])
+
+        for keys, index in ((self._container_keys, self._containers),
+                            (self._file_keys, self._files)):
+            lo = bisect.bisect_left(keys, l_query)
+            for key in keys[lo:]:
+                if not key.startswith(l_query):
+                    break
+                candidates.update(index[key])
+
+        # "container.name"
+        container, dot, name = l_query.rpartition(".")
+        if dot:
+            candidates.update(i for i in self._containers.get(container, ())
+                              if self._names[i] == name)
+
+        return candidates
+
 
 def extract_symbols(source, path):
     """extract_symbols is a generator yielding symbols for source."""
@@ -124,21 +295,70 @@ def extract_exported_symbols(source, path):
     return filter(is_exported, extract_symbols(source, path))
 
 
-def workspace_symbols(fs, root_path, parent_span):
-    """returns a list of all exported symbols under root_path in fs."""
+def workspace_symbols(fs, root_path, parent_span, token=None, cache=None):
+    """returns a SymbolTable of all exported symbols under root_path in fs.
+
+    If cache (a FileIndexCache) is given, only the files whose contents
+    aren't in it are parsed, and none are read if it has a manifest for
+    this commit.
+    """
+    if cache is not None:
+        symbols = _cached_workspace_symbols(cache)
+        if symbols is not None:
+            return symbols
+
     py_paths = (path for path in fs.walk(root_path) if path.endswith(".py"))
     py_srces = fs.batch_open(py_paths, parent_span)
-    with multiprocessing.Pool() as p:
-        symbols_chunks = p.imap_unordered(
-            _imap_extract_exported_symbols, py_srces, chunksize=10)
-        symbols = list(itertools.chain.from_iterable(symbols_chunks))
+    manifest = {}
+    cached_rows = []
+
+    def uncached_srces():
+        for path, src in py_srces:
+            digest = content_hash(src)
+            manifest[path] = digest
+            rows = cache.get(digest) if cache is not None else None
+            if rows is None:
+                yield path, src, digest
+            else:
+                cached_rows.append((path, rows))
+
+    symbols = SymbolTable()
+    rows_chunks = map_unordered(_imap_extract_exported_symbols,
+                                uncached_srces(), token)
+    for path, digest, rows in rows_chunks:
+        if token:
+            token.check()
+        if cache is not None:
+            cache.put(digest, rows)
+        symbols.extend_rows(rows, path)
+    if token:
+        # a cancelled request may have stopped feeding the pool early
+        token.check()
+    for path, rows in cached_rows:
+        symbols.extend_rows(rows, path)
+
+    if cache is not None:
+        cache.save(manifest)
+    return symbols
+
+
+def _cached_workspace_symbols(cache):
+    manifest = cache.manifest()
+    if manifest is None:
+        return None
+    symbols = SymbolTable()
+    for path, digest in manifest.items():
+        rows = cache.get(digest)
+        if rows is None:
+            return None
+        symbols.extend_rows(rows, path)
     return symbols
 
 
 # This exists purely for passing into imap
 def _imap_extract_exported_symbols(args):
-    path, src = args
-    return list(extract_exported_symbols(src, path))
+    path, src, digest = args
+    return path, digest, [s.row() for s in extract_exported_symbols(src, path)]
 
 
 class SymbolVisitor:
@@ -1,10 +1,15 @@
+from .cancellation import wait
 from .config import GlobalConfig
 from .fs import FileSystem, LocalFileSystem, FileException
-from .imports import get_imports
-from .fetch import fetch_dependency
-from .requirements_parser import parse_requirements, get_version_specifier_for_pkg
-from typing import Dict, Set, List
-
+from .imports import ImportGraph, build_import_graph
+from .index_cache import FileIndexCache
+from .package_store import get_store, link_into
+from . import stdlib_index
+from .requirements_parser import parse_requirements, parse_pipfile_lock, \
+    get_version_specifier_for_pkg
+from typing import Dict, Set, List, Tuple
+
+import concurrent.futures
 import logging
 import sys
 import os
@@ -18,12 +23,16 @@ import jedi._compatibility
 log = logging.getLogger(__name__)
 
 
-class DummyFile:
-    def __init__(self, contents):
-        self.contents = contents
+class LazyFile:
+    """A module file handed to Jedi, which is only read from fs if Jedi
+    asks for its contents (for packages it often only needs the path)."""
+
+    def __init__(self, fs: FileSystem, path: str):
+        self.fs = fs
+        self.path = path
 
     def read(self):
-        return self.contents
+        return self.fs.open(self.path)
 
     def close(self):
         pass
@@ -78,6 +87,8 @@ class Workspace:
         # turn the original root path into something that can be used as a
         # file/path name or cache key
         self.key = original_root_path.replace("/", ".").replace("\\", ".")
+        # the same, but shared by all the commits of the repository
+        self.repo_key = self.key
         if self.hash:
             self.key = ".".join((self.key, self.hash))
 
@@ -92,6 +103,9 @@ class Workspace:
         self.local_fs = LocalFileSystem()
         self.source_paths = {path for path in self.fs.walk(
             self.PROJECT_ROOT) if path.endswith(".py")}
+        # every directory containing a source file, at any depth
+        self.source_dirs = ancestor_dirs(self.source_paths)
+        self.module_table = module_table(self.source_paths)
         self.project = {}
         self.stdlib = {}
         self.dependencies = {}
@@ -99,10 +113,32 @@ class Workspace:
         # keep track of which package folders have been indexed, since we fetch
         # and index new folders on-demand
         self.indexed_folders = set()
+        # held while linking fetched packages into PACKAGES_PATH and
+        # indexing them, but not while downloading them
         self.indexing_lock = threading.Lock()
         # keep track of which packages we've tried to fetch, so we don't keep
-        # trying if they were unfetchable
-        self.fetched = set()
+        # trying if they were unfetchable: package name -> a Future that's
+        # done once the package is indexed
+        self.fetches = {}
+        self.fetches_lock = threading.Lock()
+        # the project's pinned requirements (see get_requirement_specifiers)
+        self.requirement_specifiers = None
+        # downloads queued by prefetch_dependencies, which cleanup cancels
+        # if they haven't started yet
+        self.prefetches = []
+        self.prefetch_lock = threading.Lock()
+        self.closed = False
+        # the package store entries linked into PACKAGES_PATH, and the name
+        # we're registered under as their user
+        self.store_entries = set()
+        self.store_user = "{}-{}".format(os.getpid(), self.key)
+        # a Future for the project's ImportGraph, built on first use by
+        # get_import_graph
+        self.import_graph = None
+        self.import_graph_lock = threading.Lock()
+        # the result of get_dependencies, which can't change for the
+        # revision this workspace serves
+        self.dependency_list = None
 
         self.index_project()
 
@@ -116,9 +152,7 @@ class Workspace:
             self.stdlib["nt"] = "native"
 
         if os.path.exists(self.PYTHON_PATH):
-            log.debug("Indexing standard library at %s", self.PYTHON_PATH)
-            self.index_dependencies(
-                self.stdlib, self.PYTHON_PATH, is_stdlib=True)
+            self.index_stdlib()
         else:
             log.warning("Standard library not found at %s", self.PYTHON_PATH)
 
@@ -131,82 +165,38 @@ class Workspace:
             os.makedirs(self.PACKAGES_PATH)
 
     def cleanup(self):
-        log.info("Removing package cache %s", self.PACKAGES_PATH)
-        shutil.rmtree(self.PACKAGES_PATH, True)
+        with self.prefetch_lock:
+            self.closed = True
+            for future in self.prefetches:
+                future.cancel()
+        # fetches that are still downloading see that we're closed once
+        # they get the indexing lock, and release their entries themselves
+        with self.indexing_lock:
+            log.info("Removing package cache %s", self.PACKAGES_PATH)
+            # this only removes the links into the package store
+            shutil.rmtree(self.PACKAGES_PATH, True)
+            for entry in self.store_entries:
+                get_store().release(entry, self.store_user)
+            self.store_entries.clear()
 
     def index_dependencies(self,
                            index: Dict[str, Module],
                            library_path: str,
-                           is_stdlib: bool=False,
-                           breadcrumb: str=None):
-        """Given a root library path (e.g., the Python root path or the dist-
-        packages root path), this method traverses it recursively and indexes
-        all the packages and modules contained therein. It constructs a mapping
-        from the fully qualified module name to a Module object containing the
-        metadata that Jedi needs.
-
-        :param index: the dictionary that should be used to store this index (will be modified)
-        :param library_path: the root path containing the modules and packages to be indexed
-        :param is_stdlib: flag indicating whether this invocation is indexing the standard library
-        :param breadcrumb: should be omitted by the caller; this method uses it to keep track of
-        the fully qualified module name
-        """
-        parent, this = os.path.split(library_path)
-        basename, extension = os.path.splitext(this)
-        if Workspace.is_package(
-                library_path) or extension == ".py" and this != "__init__.py":
-            qualified_name = ".".join(
-                (breadcrumb, basename)) if breadcrumb else basename
-        elif extension == ".so":
-            basename = basename.split(".")[0]
-            qualified_name = ".".join(
-                (breadcrumb, basename)) if breadcrumb else basename
-        else:
-            qualified_name = breadcrumb
+                           is_stdlib: bool=False):
+        """Indexes the packages and modules under library_path into index (see
+        index_library)."""
+        index_library(index, self.module_paths, library_path,
+                      self.PYTHON_PATH, is_stdlib)
 
-        if os.path.isdir(library_path):
-            # don't index third-party packages installed in our python path
-            if library_path == os.path.join(self.PYTHON_PATH, "site-packages"):
-                return
-
-            # recursively index this folder
-            for child in os.listdir(library_path):
-                self.index_dependencies(index, os.path.join(
-                    library_path, child), is_stdlib, qualified_name)
-        elif this == "__init__.py":
-            # we're already inside a package
-            module_name = os.path.basename(parent)
-            the_module = Module(module_name,
-                                qualified_name,
-                                library_path,
-                                True,
-                                True,
-                                is_stdlib)
-            index[qualified_name] = the_module
-            self.module_paths[os.path.abspath(the_module.path)] = the_module
-
-        elif extension == ".py":
-            # just a regular non-package module
-            the_module = Module(basename,
-                                qualified_name,
-                                library_path,
-                                False,
-                                True,
-                                is_stdlib)
-            index[qualified_name] = the_module
-            self.module_paths[os.path.abspath(the_module.path)] = the_module
+    def index_stdlib(self):
+        """Indexes the standard library at self.PYTHON_PATH.
 
-        elif extension == ".so":
-            # native module -- mark it as such and report a warning or
-            # something
-            the_module = Module(basename,
-                                qualified_name,
-                                "",
-                                False,
-                                True,
-                                is_stdlib,
-                                True)
-            index[qualified_name] = the_module
+        The index is shared by every workspace in this process (see
+        load_stdlib_index).
+        """
+        index = load_stdlib_index(self.PYTHON_PATH)
+        self.stdlib.update(index)
+        for the_module in index.values():
             self.module_paths[os.path.abspath(the_module.path)] = the_module
 
     def index_project(self):
@@ -297,39 +287,138 @@ class Workspace:
 
     def find_external_module(self, qualified_name: str) -> Module:
         package_name = qualified_name.split(".")[0]
-        if package_name not in self.fetched:
-            self.indexing_lock.acquire()
-            self.fetched.add(package_name)
-            specifier = self.get_ext_pkg_version_specifier(package_name)
-            fetch_dependency(package_name, specifier, self.PACKAGES_PATH, self.pip_args)
-            self.index_external_modules()
-            self.indexing_lock.release()
+        # a package that's already been indexed (e.g. because it was
+        # prefetched, or cached by a previous session) needn't be fetched
+        if package_name not in self.dependencies:
+            self.fetch_package(package_name)
         the_module = self.dependencies.get(qualified_name, None)
         if the_module and the_module.is_native:
             raise NotImplementedError("Unable to analyze native modules")
         else:
             return the_module
 
+    def fetch_package(self, package_name: str, specifier: str=None):
+        """Downloads and indexes the named package, unless we've already tried
+        to. If specifier isn't given, the project's requirements decide
+        which version to fetch.
+
+        Different packages are fetched in parallel, while concurrent calls
+        for the same package wait for the same fetch.
+        """
+        with self.fetches_lock:
+            future = self.fetches.get(package_name)
+            if future is None:
+                future = self.fetches[package_name] = \
+                    concurrent.futures.Future()
+                fetching = True
+            else:
+                fetching = False
+        if not fetching:
+            future.result()
+            return
+
+        try:
+            self._fetch_package(package_name, specifier)
+        except Exception as e:
+            # let a later lookup try again
+            with self.fetches_lock:
+                del self.fetches[package_name]
+            future.set_exception(e)
+            raise
+        future.set_result(None)
+
+    def _fetch_package(self, package_name: str, specifier: str=None):
+        if self.closed:
+            return
+        if specifier is None:
+            specifier = self.get_ext_pkg_version_specifier(package_name)
+        entries = get_store().fetch(package_name, specifier, self.pip_args,
+                                    self.store_user)
+        with self.indexing_lock:
+            if self.closed:
+                # cleanup already removed PACKAGES_PATH
+                for entry in entries:
+                    get_store().release(entry, self.store_user)
+                return
+            for entry in entries:
+                link_into(entry, self.PACKAGES_PATH)
+            self.store_entries.update(entries)
+            self.index_external_modules()
+
+    def prefetch_dependencies(self, parent_span: opentracing.Span,
+                              workers: int=None):
+        """Fetches and indexes the packages the project is likely to need,
+        with at most workers downloads at a time, and returns when they're
+        done.
+
+        The candidates are the external packages the project imports,
+        followed by the rest of its pinned requirements (see
+        get_requirement_specifiers).
+        """
+        workers = workers or GlobalConfig.PREFETCH_WORKERS
+        with opentracing.start_child_span(parent_span,
+                                          "prefetch_dependencies"):
+            specifiers = self.get_requirement_specifiers()
+            imported = self.get_external_imports(parent_span)
+            names = sorted(imported) + sorted(set(specifiers) - imported)
+            names = [n for n in names if n not in self.dependencies]
+            log.info("Prefetching %d dependencies", len(names))
+
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                with self.prefetch_lock:
+                    if self.closed:
+                        return
+                    self.prefetches = [
+                        pool.submit(self._prefetch_package, name,
+                                    get_version_specifier_for_pkg(
+                                        name, specifiers))
+                        for name in names]
+
+    def _prefetch_package(self, package_name: str, specifier: str):
+        try:
+            self.fetch_package(package_name, specifier)
+        except Exception:
+            log.warning("Unable to prefetch package %s", package_name,
+                        exc_info=True)
+
+    def get_requirement_specifiers(self) -> Dict[str, list]:
+        """Returns a map of the project's requirements to their version
+        specifiers, from its Pipfile.lock and requirements file (which takes
+        precedence).
+
+        (See limitations and caveats in .requirements_parser.parse_requirements()
+        and .requirements_parser.parse_pipfile_lock()).
+        """
+        if self.requirement_specifiers is None:
+            specifiers = {}
+            try:
+                specifiers.update(parse_pipfile_lock("/Pipfile.lock", self.fs))
+            except (FileException, FileNotFoundError, ValueError) as e:
+                log.debug(
+                    "no usable Pipfile.lock for {}, err: {}".format(
+                        self.PROJECT_ROOT, e))
+            try:
+                specifiers.update(parse_requirements(
+                    "/requirements.txt", self.fs))
+            except (FileException, FileNotFoundError) as e:
+                log.warning(
+                    "error parsing requirements file for {}, err: {}".format(
+                        self.PROJECT_ROOT, e))
+            self.requirement_specifiers = specifiers
+        return self.requirement_specifiers
+
     def get_ext_pkg_version_specifier(self, package_name):
         """Gets the version specifier to use after parsing the project's
-        requirements file.
+        requirements.
 
         (See limitations and caveats in .requirements_parser.parse_requirements()
         and .requirements_parser.get_version_specifier_for_pkg()).
 
-        If a requirements file isn't found at the root of the repo, or if there was an error
-        parsing it, a string representing that any version is allowed is returned.
+        If no requirements are found at the root of the repo, or if there was an error
+        parsing them, a string representing that any version is allowed is returned.
         """
-        pkg_specifiers_map = {}
-        try:
-            pkg_specifiers_map = parse_requirements(
-                "/requirements.txt", self.fs)
-        except (FileException, FileNotFoundError) as e:
-            log.warning(
-                "error parsing requirements file for {}, err: {}".format(
-                    self.PROJECT_ROOT, e))
-
-        return get_version_specifier_for_pkg(package_name, pkg_specifiers_map)
+        return get_version_specifier_for_pkg(
+            package_name, self.get_requirement_specifiers())
 
     def index_external_modules(self):
         for path in os.listdir(self.PACKAGES_PATH):
@@ -343,9 +432,9 @@ class Workspace:
         if the_module.path not in self.source_paths:
             return None
         elif the_module.is_external:
-            return DummyFile(self.local_fs.open(the_module.path, parent_span))
+            return LazyFile(self.local_fs, the_module.path)
         else:
-            return DummyFile(self.fs.open(the_module.path, parent_span))
+            return LazyFile(self.fs, the_module.path)
 
     def get_module_by_path(self, path: str) -> Module:
         return self.module_paths.get(path, None)
@@ -357,12 +446,73 @@ class Workspace:
         return list(
             filter(None, [project_module, external_module, stdlib_module]))
 
-    def get_dependencies(self, parent_span: opentracing.Span) -> list:
+    def get_import_graph(self, parent_span: opentracing.Span,
+                         token=None) -> ImportGraph:
+        """Returns the ImportGraph of the project, building it (or loading
+        it from the on-disk index cache) on first use.
+
+        The graph is built in the background, not on behalf of any one
+        request, so cancelling the request that started it (token) only
+        stops that request from waiting for it.
+        """
+        with self.import_graph_lock:
+            if self.import_graph is None:
+                self.import_graph = concurrent.futures.Future()
+                threading.Thread(target=self._build_import_graph,
+                                 args=(self.import_graph,),
+                                 daemon=True).start()
+            future = self.import_graph
+        with opentracing.start_child_span(parent_span,
+                                          "wait_for_import_graph"):
+            return wait(future, token)
+
+    def _build_import_graph(self, future: concurrent.futures.Future):
+        with opentracing.tracer.start_span("build_import_graph") as span:
+            try:
+                cache = None
+                if self.repo_key:
+                    cache = FileIndexCache("imports", self.repo_key, self.hash)
+                graph = build_import_graph(self.fs, self.PROJECT_ROOT, span,
+                                           cache=cache)
+            except Exception as e:
+                log.error("Unable to build import graph", exc_info=True)
+                # let the next request try again
+                with self.import_graph_lock:
+                    self.import_graph = None
+                future.set_exception(e)
+            else:
+                future.set_result(graph)
+
+    def get_dependencies(self, parent_span: opentracing.Span,
+                         token=None) -> list:
+        dependencies = self.dependency_list
+        if dependencies is None:
+            dependencies = self._compute_dependencies(parent_span, token)
+            self.dependency_list = dependencies
+        return dependencies
+
+    def get_external_imports(self, parent_span: opentracing.Span,
+                             token=None) -> Set[str]:
+        """Returns the top-level packages imported by the project that are
+        neither part of it nor of the standard library."""
+        _, external_imports = self._top_level_imports(parent_span, token)
+        return external_imports
+
+    def _top_level_imports(self, parent_span: opentracing.Span,
+                           token=None) -> Tuple[Set[str], Set[str]]:
+        """Returns the top-level packages imported by the project that are
+        part of the standard library, and the external ones (see
+        get_external_imports)."""
         top_level_stdlib = {p.split(".")[0] for p in self.stdlib}
-        top_level_imports = get_imports(
-            self.fs, self.PROJECT_ROOT, parent_span)
-        stdlib_imports = top_level_imports & top_level_stdlib
-        external_imports = top_level_imports - top_level_stdlib - self.project_packages
+        top_level_imports = self.get_import_graph(
+            parent_span, token).packages()
+        return (top_level_imports & top_level_stdlib,
+                top_level_imports - top_level_stdlib - self.project_packages)
+
+    def _compute_dependencies(self, parent_span: opentracing.Span,
+                              token=None) -> list:
+        stdlib_imports, external_imports = self._top_level_imports(
+            parent_span, token)
         dependencies = [{"attributes": {"name": n}} for n in external_imports]
         if stdlib_imports:
             dependencies.append({
@@ -373,19 +523,20 @@ class Workspace:
             })
         return dependencies
 
-    def get_package_information(self, parent_span: opentracing.Span) -> list:
+    def get_package_information(self, parent_span: opentracing.Span,
+                                token=None) -> list:
         if self.is_stdlib:
             return [{
                 "package": {"name": "cpython"},
                 "dependencies": []
             }]
         else:
+            # multiple packages in the project share the same dependencies
+            dependencies = self.get_dependencies(parent_span, token)
             return [
                 {
                     "package": {"name": p},
-                    # multiple packages in the project share the same
-                    # dependencies
-                    "dependencies": self.get_dependencies(parent_span)
+                    "dependencies": dependencies
                 } for p in self.project_packages
             ]
 
@@ -395,24 +546,13 @@ class Workspace:
             self, name: str, qualified_name: str, dirs: List[str]):
         module_paths = []
         for parent in dirs:
-            if os.path.join(parent, name, "__init__.py") in self.source_paths:
-                # there's a folder at this level that implements a package with
-                # the name we're looking for
-                module_path = os.path.join(parent, name, "__init__.py")
-                module_file = DummyFile(self.fs.open(module_path))
-                return module_file, module_path, True
-            elif (os.path.basename(parent) == name and
-                  os.path.join(parent, "__init__.py") in self.source_paths):
-                # we're already in a package with the name we're looking for
-                module_path = os.path.join(parent, "__init__.py")
-                module_file = DummyFile(self.fs.open(module_path))
-                return module_file, module_path, True
-            elif os.path.join(parent, name + ".py") in self.source_paths:
-                # there's a file at this level that implements a module with
-                # the name we're looking for
-                module_path = os.path.join(parent, name + ".py")
-                module_file = DummyFile(self.fs.open(module_path))
-                return module_file, module_path, False
+            found = self.module_table.get((parent, name))
+            if found:
+                # there's a package or module at this level with the name
+                # we're looking for (or we're already in a package with
+                # that name)
+                module_path, is_package = found
+                return LazyFile(self.fs, module_path), module_path, is_package
             elif self.folder_exists(os.path.join(parent, name)):
                 # there's a folder at this level that implements a namespace
                 # package with the name we're looking for
@@ -427,10 +567,7 @@ class Workspace:
             qualified_name, module_paths), False
 
     def folder_exists(self, name):
-        for path in self.source_paths:
-            if os.path.commonpath((name, path)) == name:
-                return True
-        return False
+        return name in self.source_dirs or name in self.source_paths
 
     @staticmethod
     def is_package(path: str) -> bool:
@@ -439,3 +576,162 @@ class Workspace:
     @staticmethod
     def get_top_level_package_names(index: Dict[str, Module]) -> Set[str]:
         return {name.split(".")[0] for name in index}
+
+
+def ancestor_dirs(paths) -> Set[str]:
+    """Returns the set of all the directories containing any of paths,
+    directly or indirectly."""
+    dirs = set()
+    for path in paths:
+        parent = os.path.dirname(path)
+        while parent not in dirs:
+            dirs.add(parent)
+            path, parent = parent, os.path.dirname(parent)
+            if parent == path:
+                break
+    return dirs
+
+
+def module_table(source_paths) -> Dict[Tuple[str, str], Tuple[str, bool]]:
+    """Maps (directory, name) to the (path, is_package) of the module that
+    an import of name resolves to when searching directory.
+
+    In order of precedence, that's a package folder called name in
+    directory, directory itself if it's a package called name, or a
+    name.py file in directory. Namespace packages aren't included.
+    """
+    packages = {}
+    enclosing_packages = {}
+    modules = {}
+    for path in source_paths:
+        folder, filename = os.path.split(path)
+        if filename == "__init__.py":
+            parent, name = os.path.split(folder)
+            packages[(parent, name)] = (path, True)
+            enclosing_packages[(folder, name)] = (path, True)
+        else:
+            modules[(folder, filename[:-len(".py")])] = (path, False)
+    table = modules
+    table.update(enclosing_packages)
+    table.update(packages)
+    return table
+
+
+def index_library(index: Dict[str, Module],
+                  module_paths: Dict[str, Module],
+                  library_path: str,
+                  python_path: str,
+                  is_stdlib: bool=False,
+                  breadcrumb: str=None):
+    """Given a root library path (e.g., the Python root path or the dist-
+    packages root path), this function traverses it recursively and indexes
+    all the packages and modules contained therein. It constructs a mapping
+    from the fully qualified module name to a Module object containing the
+    metadata that Jedi needs.
+
+    :param index: the dictionary that should be used to store this index (will be modified)
+    :param module_paths: the dictionary mapping module paths to Modules (will be modified)
+    :param library_path: the root path containing the modules and packages to be indexed
+    :param python_path: the standard library path, whose site-packages are skipped
+    :param is_stdlib: flag indicating whether this invocation is indexing the standard library
+    :param breadcrumb: should be omitted by the caller; this function uses it to keep track of
+    the fully qualified module name
+    """
+    parent, this = os.path.split(library_path)
+    basename, extension = os.path.splitext(this)
+    if Workspace.is_package(
+            library_path) or extension == ".py" and this != "__init__.py":
+        qualified_name = ".".join(
+            (breadcrumb, basename)) if breadcrumb else basename
+    elif extension == ".so":
+        basename = basename.split(".")[0]
+        qualified_name = ".".join(
+            (breadcrumb, basename)) if breadcrumb else basename
+    else:
+        qualified_name = breadcrumb
+
+    if os.path.isdir(library_path):
+        # don't index third-party packages installed in our python path
+        if library_path == os.path.join(python_path, "site-packages"):
+            return
+
+        # recursively index this folder
+        for child in os.listdir(library_path):
+            index_library(index, module_paths, os.path.join(
+                library_path, child), python_path, is_stdlib, qualified_name)
+    elif this == "__init__.py":
+        # we're already inside a package
+        module_name = os.path.basename(parent)
+        the_module = Module(module_name,
+                            qualified_name,
+                            library_path,
+                            True,
+                            True,
+                            is_stdlib)
+        index[qualified_name] = the_module
+        module_paths[os.path.abspath(the_module.path)] = the_module
+
+    elif extension == ".py":
+        # just a regular non-package module
+        the_module = Module(basename,
+                            qualified_name,
+                            library_path,
+                            False,
+                            True,
+                            is_stdlib)
+        index[qualified_name] = the_module
+        module_paths[os.path.abspath(the_module.path)] = the_module
+
+    elif extension == ".so":
+        # native module -- mark it as such and report a warning or
+        # something
+        the_module = Module(basename,
+                            qualified_name,
+                            "",
+                            False,
+                            True,
+                            is_stdlib,
+                            True)
+        index[qualified_name] = the_module
+        module_paths[os.path.abspath(the_module.path)] = the_module
+
+
+# standard library indexes by path, shared by all the workspaces in this
+# process (and, when built before forking, by the forked children too)
+_stdlib_indexes = {}
+_stdlib_indexes_lock = threading.Lock()
+
+
+def load_stdlib_index(python_path: str) -> Dict[str, Module]:
+    """Returns the index of the standard library at python_path.
+
+    The index is built at most once per process: it's loaded from the
+    on-disk cache (see .stdlib_index) if that's fresh, and otherwise
+    built by walking python_path and written back to the cache. The
+    returned dictionary is shared, so callers mustn't modify it.
+    """
+    with _stdlib_indexes_lock:
+        index = _stdlib_indexes.get(python_path)
+        if index is not None:
+            return index
+
+        index = {}
+        rows = stdlib_index.load(python_path)
+        if rows is None:
+            log.debug("Indexing standard library at %s", python_path)
+            index_library(index, {}, python_path, python_path, is_stdlib=True)
+            stdlib_index.save(python_path, [
+                (qualified_name,
+                 m.name,
+                 os.path.relpath(m.path, python_path) if m.path else "",
+                 m.is_package,
+                 m.is_native) for qualified_name, m in index.items()])
+        else:
+            log.debug("Loaded standard library index for %s", python_path)
+            for qualified_name, name, rel_path, is_package, is_native in rows:
+                path = os.path.join(python_path, rel_path) if rel_path else ""
+                index[qualified_name] = Module(name, qualified_name, path,
+                                               is_package, True, True,
+                                               is_native)
+        _stdlib_indexes[python_path] = index
+        return index
@@ -1,16 +1,32 @@
 #!/usr/local/bin/python3
 
+import io
+import os
 import os.path
 import sys
+import tarfile
+import threading
+import types
 
 import opentracing
 import pytest
 
 sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
 
-from langserver.fs import InMemoryFileSystem  # noqa: E402
+from langserver import index_cache  # noqa: E402
+from langserver.cancellation import RequestCancelled  # noqa: E402
+from langserver.fs import (  # noqa: E402
+    ContentCache, FileList, InMemoryFileSystem, RemoteFileSystem)
+from langserver.index_cache import FileIndexCache, content_hash  # noqa: E402
+from langserver.jedi import ScriptCache  # noqa: E402
+from langserver.jsonrpc import JSONRPC2Connection, ReadWriter  # noqa: E402
 from langserver.langserver import LangServer  # noqa: E402
-from langserver.symbols import extract_symbols  # noqa: E402
+from langserver.fs import FileException  # noqa: E402
+from langserver.package_store import (  # noqa: E402
+    PackageStore, archive_key, link_into, pinned_version)
+from langserver.symbols import SymbolIndex, SymbolTable, extract_symbols  # noqa: E402
+from langserver.requirements_parser import parse_pipfile_lock  # noqa: E402
+from langserver.workspace import Workspace, ancestor_dirs, module_table  # noqa: E402
 
 FS = InMemoryFileSystem({
     '/example_file.py':
@@ -72,6 +88,25 @@ def test_extract_symbols():
     assert got == want
 
 
+def test_symbol_index():
+    symbols = []
+    for path in ('/example_file.py', '/a.py', '/c.py'):
+        symbols.extend(extract_symbols(FS.open(path, parent_span=None), path))
+    table = SymbolTable()
+    for s in symbols:
+        table.append(s)
+    index = SymbolIndex(table)
+    for query in ('', 'f', 'ba', 'foo', 'BAR', 'myclass', 'MyClass.foo',
+                  '/example', 'nothing'):
+        for limit in (1, 3, 50):
+            scored = ((s.score(query), s) for s in symbols)
+            scored = [(score, s) for (score, s) in scored if score >= 0]
+            want = [s.json_object() for (_, s) in sorted(
+                scored, reverse=True, key=lambda x: x[0])[:limit]]
+            got = [s.json_object() for s in index.search(query, limit)]
+            assert got == want
+
+
 def test_hover_on_def():
     h = hover('/a.py', 1, 7)
     assert h == {
@@ -159,6 +194,159 @@ def hover(path, line, character):
     })
 
 
+class FakeRemoteJedi:
+    """Hands out stand-ins for Jedi Scripts, counting how many it made."""
+
+    def __init__(self):
+        self.created = 0
+
+    def new_script(self, path, source, line, column, parent_span, context):
+        self.created += 1
+        return types.SimpleNamespace(path=path, _pos=(line, column))
+
+
+def test_script_cache():
+    remote_jedi = FakeRemoteJedi()
+    scripts = ScriptCache(remote_jedi, size=2)
+    source = "import os\nos.path\n"
+    with scripts.checkout("/a.py", source, 1, 0, None) as first:
+        assert first._pos == (1, 0)
+
+    # the next request on the file reuses the Script, moved to its position
+    # without disturbing the cached one
+    with scripts.checkout("/a.py", source, 2, 3, None) as moved:
+        assert moved is not first
+        assert moved._pos == (2, 3)
+        assert first._pos == (1, 0)
+    with scripts.checkout("/a.py", source, 1, 0, None) as script:
+        assert script is first
+    assert (remote_jedi.created, scripts.hits, scripts.misses) == (1, 2, 1)
+
+    # a change to the file's contents needs a new Script
+    with scripts.checkout("/a.py", source + "\n", 1, 0, None):
+        pass
+    assert (remote_jedi.created, scripts.hits, scripts.misses) == (2, 2, 2)
+
+    # and so do bad positions
+    with pytest.raises(ValueError):
+        with scripts.checkout("/a.py", source, 4, 0, None):
+            pass
+    with pytest.raises(ValueError):
+        with scripts.checkout("/a.py", source, 1, 10, None):
+            pass
+
+
+def test_script_cache_drops_failed_scripts():
+    remote_jedi = FakeRemoteJedi()
+    scripts = ScriptCache(remote_jedi)
+    source = "import os\n"
+
+    # a Script whose request raised, or failed without raising, isn't reused
+    with pytest.raises(RequestCancelled):
+        with scripts.checkout("/a.py", source, 1, 0, None):
+            raise RequestCancelled()
+    with scripts.checkout("/a.py", source, 1, 0, None, failed=lambda: True):
+        pass
+    with scripts.checkout("/a.py", source, 1, 0, None, failed=lambda: False):
+        pass
+    with scripts.checkout("/a.py", source, 1, 0, None):
+        pass
+    assert (remote_jedi.created, scripts.hits) == (3, 1)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.responses = []
+        self.errors = []
+
+    def write_response(self, rid, result):
+        self.responses.append((rid, result))
+
+    def write_error(self, rid, code, message, data=None):
+        self.errors.append((rid, code))
+
+
+def test_failed_request_drops_script():
+    server = LangServer(conn=FakeConnection())
+    server.scripts = ScriptCache(FakeRemoteJedi())
+
+    def serve_hover(request):
+        server.new_script(path="/a.py", source="import os\n", line=1,
+                          column=0, parent_span=request["span"],
+                          request=request)
+        if request["params"].get("cancel"):
+            raise RequestCancelled()
+        return {"contents": []}
+
+    server.serve_hover = serve_hover
+    server.handle({"id": 1, "method": "textDocument/hover",
+                   "params": {"cancel": True}})
+    assert server.conn.errors == [(1, -32800)]
+    assert len(server.scripts._scripts) == 0
+    server.handle({"id": 2, "method": "textDocument/hover", "params": {}})
+    assert server.conn.responses == [(2, {"contents": []})]
+    assert len(server.scripts._scripts) == 1
+
+
+def test_cancel_queued_request():
+    server = LangServer(conn=FakeConnection())
+    request = {"id": 1, "method": "shutdown", "params": {},
+               "token": server.new_cancellation_token(1)}
+    server.handle({"method": "$/cancelRequest", "params": {"id": 1}})
+    server.handle_safely(request)
+    assert server.conn.errors == [(1, -32800)]
+    assert server.conn.responses == []
+    assert server.cancellation_tokens == {}
+
+
+def test_cancel_request_in_flight():
+    server = LangServer(conn=FakeConnection())
+    started = threading.Event()
+
+    def serve_symbols(request):
+        started.set()
+        while True:
+            request["token"].check()
+
+    server.serve_symbols = serve_symbols
+    request = {"id": 1, "method": "workspace/symbol", "params": {},
+               "token": server.new_cancellation_token(1)}
+    t = threading.Thread(target=server.handle_safely, args=(request,))
+    t.start()
+    started.wait()
+    server.handle({"method": "$/cancelRequest", "params": {"id": 1}})
+    t.join()
+    assert server.conn.errors == [(1, -32800)]
+
+
+class CancelledDefinition:
+    """A Jedi Definition whose docstring is cancelled while it's being
+    inferred."""
+    name = full_name = "f"
+    type = "function"
+    params = []
+
+    def docstring(self, raw=False):
+        raise RequestCancelled()
+
+    def get_line_code(self):
+        return "def f():"
+
+
+def test_cancel_hover_while_accumulating(monkeypatch):
+    server = LangServer(conn=FakeConnection())
+    server.fs = InMemoryFileSystem({"/a.py": "f()\n"})
+    server.scripts = ScriptCache(FakeRemoteJedi())
+    monkeypatch.setattr(LangServer, "goto_definitions",
+                        staticmethod(lambda script, request: [CancelledDefinition()]))
+    server.handle({"id": 1, "method": "textDocument/hover", "params": {
+        "textDocument": {"uri": "file:///a.py"},
+        "position": {"line": 0, "character": 0},
+    }})
+    assert server.conn.errors == [(1, -32800)]
+    assert server.conn.responses == []
+
+
 def test_inmemory_fs():
     contents = {
         "/a": "a",
@@ -180,3 +368,551 @@ def test_inmemory_fs():
         want = sorted(want)
         got = sorted([e.name for e in fs.listdir(d, parent_span=None)])
         assert got == want
+
+
+def test_module_table():
+    table = module_table([
+        # a package wins over a module with the same name
+        "/a/x/__init__.py",
+        "/a/x.py",
+        "/a/x/helper.py",
+        # the enclosing package wins over a module with its name in it
+        "/b/y/__init__.py",
+        "/b/y/y.py",
+        # a package within it wins over both
+        "/c/z/__init__.py",
+        "/c/z/z.py",
+        "/c/z/z/__init__.py",
+    ])
+    assert table[("/a", "x")] == ("/a/x/__init__.py", True)
+    assert table[("/a/x", "x")] == ("/a/x/__init__.py", True)
+    assert table[("/a/x", "helper")] == ("/a/x/helper.py", False)
+    assert table[("/b/y", "y")] == ("/b/y/__init__.py", True)
+    assert table[("/c/z", "z")] == ("/c/z/z/__init__.py", True)
+    assert table[("/c/z/z", "z")] == ("/c/z/z/__init__.py", True)
+    assert ("/a", "helper") not in table
+
+
+def test_ancestor_dirs():
+    assert ancestor_dirs(["/a/x/__init__.py", "/a/y.py", "/b/c/d.py"]) == {
+        "/", "/a", "/a/x", "/b", "/b/c"}
+    assert ancestor_dirs([]) == set()
+
+
+NEIGHBOURS = ["/a.py", "/a/x.py", "/a/b/y.py", "/a0.py", "/a-b/x.py", "/ab/y.py"]
+
+
+def test_file_list_under():
+    files = FileList("/", NEIGHBOURS)
+    assert files.under("/a") == ("/a/b/y.py", "/a/x.py")
+    assert files.under("/a/") == ("/a/b/y.py", "/a/x.py")
+    assert files.under("/a/b") == ("/a/b/y.py",)
+    assert files.under("/ab") == ("/ab/y.py",)
+    assert files.under("/a-b") == ("/a-b/x.py",)
+    assert files.under("/") == tuple(sorted(NEIGHBOURS))
+    assert files.under("/c") == ()
+
+
+def test_file_list_covers():
+    files = FileList("/a", ["/a/x.py", "/a/b/y.py"])
+    assert files.covers("/a")
+    assert files.covers("/a/b")
+    assert not files.covers("/ab")
+    assert not files.covers("/a-b")
+    assert not files.covers("/")
+    assert FileList("/", NEIGHBOURS).covers("/ab")
+
+
+class FakeWorkspaceConnection:
+    """Answers workspace/xfiles and textDocument/xcontent requests for
+    files, counting the requests it gets."""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    def send_request(self, method, params):
+        self.requests.append((method, params))
+        if method == "workspace/xfiles":
+            base = params["base"][len("file://"):].rstrip("/") + "/"
+            return {"result": [{"uri": "file://" + path}
+                               for path in self.files
+                               if path.startswith(base)]}
+        path = params["textDocument"]["uri"][len("file://"):]
+        return {"result": {"text": self.files[path]}}
+
+
+def test_remote_fs_walk():
+    conn = FakeWorkspaceConnection({path: "" for path in NEIGHBOURS})
+    fs = RemoteFileSystem(conn)
+
+    assert sorted(fs.walk("/a")) == ["/a/b/y.py", "/a/x.py"]
+    assert len(conn.requests) == 1
+    # a subdirectory of a fetched one is served from its snapshot
+    assert list(fs.walk("/a/b")) == ["/a/b/y.py"]
+    assert len(conn.requests) == 1
+    # but a neighbour with the same prefix isn't
+    assert list(fs.walk("/ab")) == ["/ab/y.py"]
+    assert len(conn.requests) == 2
+    # and the root needs one more fetch, which then serves everything
+    assert sorted(fs.walk("/")) == sorted(NEIGHBOURS)
+    assert list(fs.walk("/a-b")) == ["/a-b/x.py"]
+    assert len(conn.requests) == 3
+    assert [params["base"] for _, params in conn.requests] == [
+        "file:///a", "file:///ab", "file:///"]
+
+
+def test_content_cache():
+    one, two, three = "1" * 100, "2" * 100, "3" * 100
+    cache = ContentCache(2 * sys.getsizeof(one))
+    assert cache.get("/1") is None
+    cache.put("/1", one)
+    cache.put("/2", two)
+    assert cache.get("/1") == one
+    # the least recently used contents go first
+    cache.put("/3", three)
+    assert cache.get("/2") is None
+    assert cache.get("/1") == one
+    assert cache.get("/3") == three
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert cache.size == 2 * sys.getsizeof(one)
+
+    # replacing contents doesn't count them twice
+    cache.put("/3", three)
+    assert cache.size == 2 * sys.getsizeof(one)
+    # and contents too big for the whole cache aren't cached at all
+    cache.put("/big", one * 3)
+    assert cache.get("/big") is None
+    assert cache.get("/1") == one
+
+
+def test_remote_fs_caches_contents():
+    conn = FakeWorkspaceConnection({"/a.py": "a = 1", "/b.py": "b = 2"})
+    fs = RemoteFileSystem(conn)
+    assert fs.open("/a.py") == "a = 1"
+    assert fs.open("/a.py") == "a = 1"
+    assert len(conn.requests) == 1
+    assert (fs.cache.hits, fs.cache.misses) == (1, 1)
+
+
+def connected_pair():
+    """Returns two JSONRPC2Connections talking to each other over pipes."""
+    a_read, b_write = os.pipe()
+    b_read, a_write = os.pipe()
+    a = JSONRPC2Connection(ReadWriter(open(a_read, "rb"), open(a_write, "wb")))
+    b = JSONRPC2Connection(ReadWriter(open(b_read, "rb"), open(b_write, "wb")))
+    return a, b
+
+
+def echo(conn, requests=None):
+    """Answers every request sent to conn with its params."""
+    while True:
+        try:
+            msg = conn.read_message()
+        except EOFError:
+            return
+        if requests is not None:
+            requests.append(msg)
+        if "id" in msg:
+            conn.write_response(msg["id"], msg["params"])
+
+
+def test_jsonrpc_send_request():
+    server, client = connected_pair()
+    threading.Thread(target=echo, args=(client,), daemon=True).start()
+    results = {}
+
+    def send(n):
+        results[n] = server.send_request("echo", n)["result"]
+
+    # concurrent requests each get their own response
+    threads = [threading.Thread(target=send, args=(n,)) for n in range(20)]
+    for t in threads:
+        t.start()
+    # while requests from the other side are still delivered to read_message
+    client.send_notification("initialized", {})
+    assert server.read_message()["method"] == "initialized"
+    for t in threads:
+        t.join()
+    assert results == {n: n for n in range(20)}
+    assert server._pending == {}
+    server.conn.writer.close()
+    client.conn.writer.close()
+
+
+def test_jsonrpc_send_request_batch():
+    server, client = connected_pair()
+    received = []
+    threading.Thread(target=echo, args=(client, received), daemon=True).start()
+    window = 3
+    responses = []
+
+    def requests(count):
+        for n in range(count):
+            # the request isn't sent until there's room in the window
+            assert n - len(responses) < window
+            yield "echo", n
+
+    for response in server.send_request_batch(requests(20), window):
+        responses.append(response)
+    assert [r["result"] for r in responses] == list(range(20))
+
+    # closing the responses early stops sending requests, and forgets the
+    # ones that are still outstanding
+    responses = []
+    batch = server.send_request_batch(requests(10 ** 6), window)
+    for _ in range(3):
+        responses.append(next(batch))
+    batch.close()
+    assert server._pending == {}
+    assert len(received) <= 20 + 3 + window
+    server.conn.writer.close()
+    client.conn.writer.close()
+
+
+def test_jsonrpc_disconnect_fails_pending_requests():
+    server, client = connected_pair()
+    results = []
+
+    def send():
+        try:
+            server.send_request("never_answered", {})
+        except EOFError as e:
+            results.append(e)
+
+    t = threading.Thread(target=send)
+    t.start()
+    assert client.read_message()["method"] == "never_answered"
+    client.conn.writer.close()
+    t.join()
+    assert len(results) == 1
+    with pytest.raises(EOFError):
+        server.read_message()
+    # and so do requests sent after the other side went away
+    with pytest.raises(EOFError):
+        server.send_request("too_late", {})
+    server.conn.writer.close()
+
+
+def test_archive_key():
+    assert archive_key("requests-2.18.4-py2.py3-none-any.whl") == "requests-2.18.4"
+    assert archive_key("Flask_SQLAlchemy-2.3.2.tar.gz") == "flask-sqlalchemy-2.3.2"
+    assert archive_key("python-dateutil-2.7.3.zip") == "python-dateutil-2.7.3"
+    assert archive_key("some.pkg-1.0") == "some-pkg-1.0"
+
+
+def test_pinned_version():
+    assert pinned_version("==1.2") == "1.2"
+    assert pinned_version("== 1.2 ") == "1.2"
+    assert pinned_version("") is None
+    assert pinned_version(">=1.2") is None
+    assert pinned_version("==1.*") is None
+    assert pinned_version("==1.2,!=1.2.1") is None
+
+
+def make_tree(root, paths):
+    for path in paths:
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(path)
+
+
+def test_link_into_merges_folders(tmpdir):
+    root = str(tmpdir)
+    make_tree(root, [
+        "a/ns/a/__init__.py",
+        "a/top.py",
+        "b/ns/b/__init__.py",
+        "b/top.py",
+    ])
+    view = os.path.join(root, "view")
+    os.mkdir(view)
+    link_into(os.path.join(root, "a"), view)
+    link_into(os.path.join(root, "b"), view)
+
+    # the namespace package shared by both entries is a real folder holding
+    # a link to each one's subpackage
+    assert not os.path.islink(os.path.join(view, "ns"))
+    assert sorted(os.listdir(os.path.join(view, "ns"))) == ["a", "b"]
+    assert os.path.islink(os.path.join(view, "ns", "a"))
+    assert os.path.isfile(os.path.join(view, "ns", "b", "__init__.py"))
+    # the entry linked last wins for files they both have
+    assert os.path.realpath(os.path.join(view, "top.py")) == \
+        os.path.join(root, "b", "top.py")
+    # and the store entries themselves are untouched
+    assert sorted(os.listdir(os.path.join(root, "a", "ns"))) == ["a"]
+
+
+def add_entry(store, key, size, mtime, users=()):
+    os.makedirs(os.path.join(store.root, key))
+    with open(os.path.join(store.root, key + ".size"), "w") as f:
+        f.write(str(size))
+    os.utime(os.path.join(store.root, key), (mtime, mtime))
+    for user in users:
+        users_path = os.path.join(store.root, ".users", key)
+        os.makedirs(users_path, exist_ok=True)
+        open(os.path.join(users_path, user), "w").close()
+
+
+def test_package_store_evict(tmpdir):
+    store = PackageStore(str(tmpdir), 300)
+    dead_pid = 2 ** 22 + 1  # above the largest pid Linux hands out
+    add_entry(store, "oldest-1.0", 100, 1000, ["{}-x".format(os.getpid())])
+    add_entry(store, "old-1.0", 100, 2000, ["{}-x".format(dead_pid)])
+    add_entry(store, "new-1.0", 100, 3000)
+    add_entry(store, "newest-1.0", 100, 4000)
+    store._evict()
+
+    # the least recently used entries go first, unless a live session uses
+    # them, until the rest fit
+    assert sorted(k for k in os.listdir(store.root) if not k.startswith(".")) == [
+        "new-1.0", "new-1.0.size", "newest-1.0", "newest-1.0.size",
+        "oldest-1.0", "oldest-1.0.size"]
+    assert not os.path.exists(os.path.join(store.root, ".users", "old-1.0"))
+
+
+def test_package_store_reuses_resolved_version(tmpdir, monkeypatch):
+    downloads = []
+
+    def download(name, specifier, folder, pip_args):
+        downloads.append(name + specifier)
+        data = b"VERSION = '1.0'\n"
+        info = tarfile.TarInfo("pkg/__init__.py")
+        info.size = len(data)
+        with tarfile.open(os.path.join(folder, "pkg-1.0.tar.gz"), "w:gz") as f:
+            f.addfile(info, io.BytesIO(data))
+        return True
+
+    monkeypatch.setattr("langserver.fetch.download", download)
+    store = PackageStore(str(tmpdir), 1024 * 1024)
+    entries = store.fetch("pkg", "", [], "{}-a".format(os.getpid()))
+    assert entries == [os.path.join(str(tmpdir), "pkg-1.0")]
+    assert os.path.isfile(os.path.join(entries[0], "pkg", "__init__.py"))
+
+    # an unpinned requirement that was resolved before doesn't run pip again,
+    # and neither does pinning the version it resolved to
+    assert store.fetch("pkg", "", [], "{}-b".format(os.getpid())) == entries
+    assert store.fetch("pkg", "==1.0", [], "{}-c".format(os.getpid())) == entries
+    assert downloads == ["pkg"]
+    assert sorted(os.listdir(os.path.join(str(tmpdir), ".users", "pkg-1.0"))) == [
+        "{}-{}".format(os.getpid(), user) for user in "abc"]
+
+    # unless it was resolved too long ago
+    monkeypatch.setattr("langserver.config.GlobalConfig.PACKAGE_RESOLUTION_TTL", -1)
+    assert store.fetch("pkg", "", [], "{}-d".format(os.getpid())) == entries
+    assert downloads == ["pkg", "pkg"]
+
+
+def make_workspace(tmpdir, monkeypatch, files):
+    monkeypatch.setattr("langserver.config.GlobalConfig.PACKAGES_PARENT", str(tmpdir))
+    # skip indexing the standard library
+    monkeypatch.setattr("langserver.config.GlobalConfig.PYTHON_PATH",
+                        os.path.join(str(tmpdir), "no-stdlib"))
+    fs = RemoteFileSystem(FakeWorkspaceConnection(files))
+    return Workspace(fs, "/", "github.com/example/project")
+
+
+def test_fetch_package_once(tmpdir, monkeypatch):
+    workspace = make_workspace(tmpdir, monkeypatch, {"/a.py": "import pkg\n"})
+    fetched = []
+    started = threading.Event()
+    finish = threading.Event()
+
+    def fetch(package_name, specifier=None):
+        fetched.append(package_name)
+        if package_name == "pkg":
+            started.set()
+            finish.wait()
+
+    monkeypatch.setattr(workspace, "_fetch_package", fetch)
+    waiters = [threading.Thread(target=workspace.fetch_package, args=("pkg",))
+               for _ in range(5)]
+    for t in waiters:
+        t.start()
+    started.wait()
+
+    # other packages aren't held up by the fetch in progress
+    other = threading.Thread(target=workspace.fetch_package, args=("other",))
+    other.start()
+    other.join(5)
+    assert not other.is_alive()
+    # while concurrent callers for the same package wait for it
+    assert all(t.is_alive() for t in waiters)
+
+    finish.set()
+    for t in waiters:
+        t.join()
+    workspace.fetch_package("pkg")
+    assert sorted(fetched) == ["other", "pkg"]
+
+
+def test_fetch_package_retries_failures(tmpdir, monkeypatch):
+    workspace = make_workspace(tmpdir, monkeypatch, {"/a.py": "import pkg\n"})
+    fetched = []
+    started = threading.Event()
+    finish = threading.Event()
+
+    def fetch(package_name, specifier=None):
+        fetched.append(package_name)
+        if len(fetched) == 1:
+            started.set()
+            finish.wait()
+            raise OSError("index unavailable")
+
+    monkeypatch.setattr(workspace, "_fetch_package", fetch)
+    errors = []
+
+    def fetch_package():
+        try:
+            workspace.fetch_package("pkg")
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch_package) for _ in range(3)]
+    threads[0].start()
+    started.wait()
+    # let the fetch fail only once the others are waiting for it
+    future = workspace.fetches["pkg"]
+    waiting = threading.Semaphore(0)
+
+    def result(*args):
+        waiting.release()
+        return type(future).result(future, *args)
+
+    future.result = result
+    for t in threads[1:]:
+        t.start()
+    for t in threads[1:]:
+        waiting.acquire()
+    finish.set()
+    for t in threads:
+        t.join()
+    # everyone waiting for the failed fetch sees its error
+    assert len(errors) == 3
+    assert fetched == ["pkg"]
+
+    # and the next lookup tries again
+    workspace.fetch_package("pkg")
+    workspace.fetch_package("pkg")
+    assert fetched == ["pkg", "pkg"]
+
+
+PIPFILE_LOCK = """{
+    "_meta": {"hash": {"sha256": "0123"}},
+    "default": {
+        "requests": {"version": "==2.18.4", "hashes": []},
+        "six": {"version": "==1.11.0"},
+        "mylib": {"git": "https://github.com/example/mylib.git", "ref": "abc"},
+        "anything": {"version": "*"},
+        "local": {"path": ".", "editable": true}
+    },
+    "develop": {
+        "pytest": {"version": "==3.6.0"}
+    }
+}"""
+
+
+def test_parse_pipfile_lock():
+    fs = InMemoryFileSystem({"/Pipfile.lock": PIPFILE_LOCK, "/bad.lock": "{"})
+    # only the pinned default packages are kept
+    assert parse_pipfile_lock("/Pipfile.lock", fs) == {
+        "requests": [("==", "2.18.4")],
+        "six": [("==", "1.11.0")],
+    }
+    with pytest.raises(ValueError):
+        parse_pipfile_lock("/bad.lock", fs)
+    with pytest.raises(FileException):
+        parse_pipfile_lock("/missing.lock", fs)
+
+
+def test_requirements_take_precedence(tmpdir, monkeypatch):
+    workspace = make_workspace(tmpdir, monkeypatch, {
+        "/a.py": "import requests\n",
+        "/Pipfile.lock": PIPFILE_LOCK,
+        "/requirements.txt": "requests==2.19.1\n",
+    })
+    assert workspace.get_requirement_specifiers() == {
+        "requests": [("==", "2.19.1")],
+        "six": [("==", "1.11.0")],
+    }
+    assert workspace.get_ext_pkg_version_specifier("requests") == "==2.19.1"
+    assert workspace.get_ext_pkg_version_specifier("mylib") == ""
+
+
+def test_invalid_pipfile_lock_is_ignored(tmpdir, monkeypatch):
+    workspace = make_workspace(tmpdir, monkeypatch, {
+        "/a.py": "import requests\n",
+        "/Pipfile.lock": "{",
+        "/requirements.txt": "requests==2.19.1\n",
+    })
+    assert workspace.get_requirement_specifiers() == {
+        "requests": [("==", "2.19.1")],
+    }
+
+
+def test_file_index_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr("langserver.config.GlobalConfig.INDEX_CACHE_PATH", str(tmpdir))
+    monkeypatch.setattr("langserver.config.GlobalConfig.INDEX_CACHE_COMMITS", 2)
+    a, b, c = (content_hash(s) for s in ("a = 1", "b = 2", "c = 3"))
+
+    cache = FileIndexCache("symbols", "repo", "commit1")
+    assert cache.manifest() is None
+    cache.put(a, ["a"])
+    cache.put(b, ["b"])
+    cache.save({"/a.py": a, "/b.py": b})
+
+    # a later session for the same commit gets the manifest and results back
+    cache = FileIndexCache("symbols", "repo", "commit1")
+    assert cache.manifest() == {"/a.py": a, "/b.py": b}
+    assert cache.get(a) == ["a"]
+    # but not one for another commit, or without a commit
+    assert FileIndexCache("symbols", "repo", "commit2").manifest() is None
+    assert FileIndexCache("symbols", "repo").manifest() is None
+    # and the results of other repositories and kinds are kept apart
+    assert FileIndexCache("symbols", "other", "commit1").get(a) is None
+    assert FileIndexCache("imports", "repo", "commit1").get(a) is None
+
+    # results are shared between commits
+    cache = FileIndexCache("symbols", "repo", "commit2")
+    assert cache.get(b) == ["b"]
+    cache.put(c, ["c"])
+    cache.save({"/b.py": b, "/c.py": c})
+    cache = FileIndexCache("symbols", "repo", "commit3")
+    cache.save({"/c.py": c})
+
+    # only the last INDEX_CACHE_COMMITS manifests are kept, along with the
+    # results they use
+    cache = FileIndexCache("symbols", "repo", "commit1")
+    assert cache.manifest() is None
+    assert cache.get(a) is None
+    assert cache.get(b) == ["b"]
+    assert FileIndexCache("symbols", "repo", "commit2").manifest() == {
+        "/b.py": b, "/c.py": c}
+
+    # caches written in an older format are ignored
+    monkeypatch.setattr(index_cache, "FORMAT_VERSION", index_cache.FORMAT_VERSION + 1)
+    cache = FileIndexCache("symbols", "repo", "commit2")
+    assert cache.manifest() is None
+    assert cache.get(b) is None
+
+
+def test_file_index_cache_merges_concurrent_sessions(tmpdir, monkeypatch):
+    monkeypatch.setattr("langserver.config.GlobalConfig.INDEX_CACHE_PATH", str(tmpdir))
+    a, b = content_hash("a = 1"), content_hash("b = 2")
+
+    # two sessions on different commits load the cache before either saves
+    first = FileIndexCache("symbols", "repo", "commit1")
+    second = FileIndexCache("symbols", "repo", "commit2")
+    first.put(a, ["a"])
+    first.save({"/a.py": a})
+    second.put(b, ["b"])
+    second.save({"/b.py": b})
+
+    # and neither loses the other's work
+    cache = FileIndexCache("symbols", "repo", "commit1")
+    assert cache.manifest() == {"/a.py": a}
+    assert cache.get(a) == ["a"]
+    cache = FileIndexCache("symbols", "repo", "commit2")
+    assert cache.manifest() == {"/b.py": b}
+    assert cache.get(b) == ["b"]